@@ -0,0 +1,40 @@
+import time
+import threading
+from typing import Optional
+
+
+class BandwidthLimiter:
+    """
+    令牌桶带宽限制器，多个下载线程共享同一个速率上限。
+    桶容量为一秒的流量，允许短暂突发。
+    """
+
+    def __init__(self, bytes_per_second: int):
+        """
+        :param bytes_per_second: 每秒允许的字节数
+        """
+        self.rate = max(1, bytes_per_second)
+        self._allowance = float(self.rate)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, num_bytes: int, cancel_event: Optional[threading.Event] = None) -> bool:
+        """
+        消耗令牌，超出速率时阻塞等待
+        :param num_bytes: 本次读取的字节数
+        :param cancel_event: 等待期间可被该事件打断
+        :return: 正常返回 True；等待期间被取消返回 False
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(float(self.rate), self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= num_bytes
+            deficit = -self._allowance
+        if deficit <= 0:
+            return True
+        wait_seconds = deficit / self.rate
+        if cancel_event is not None:
+            return not cancel_event.wait(wait_seconds)
+        time.sleep(wait_seconds)
+        return True
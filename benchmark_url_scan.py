@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import logging
+from openpyxl import Workbook
+
+from excel_image_embedder import ExcelImageEmbedder, SCAN_ENGINE_OPENPYXL, SCAN_ENGINE_COLUMNAR
+
+
+def generate_workbook(path: str, rows: int, cols: int, url_ratio: float, sheets: int, seed: int) -> None:
+    """
+    生成用于基准测试的工作簿（write_only 模式，内存占用与行数无关）
+    :param path: 输出路径
+    :param rows: 每个 sheet 的行数
+    :param cols: 每行的列数
+    :param url_ratio: 单元格为图片URL的比例
+    :param sheets: sheet 数量
+    :param seed: 随机种子
+    """
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    for sheet_index in range(sheets):
+        ws = wb.create_sheet(f"Sheet{sheet_index + 1}")
+        for row in range(rows):
+            values = []
+            for col in range(cols):
+                roll = rng.random()
+                if roll < url_ratio:
+                    # 少量不同的 URL 反复出现，与真实表格中共享字符串的分布相近
+                    values.append(f"https://img.example.com/{rng.randrange(rows)}.{rng.choice(('jpg', 'PNG', 'webp'))}")
+                elif roll < url_ratio + 0.1:
+                    values.append(f"https://example.com/page/{row}")
+                elif roll < url_ratio + 0.4:
+                    values.append(rng.randrange(1000000))
+                else:
+                    values.append(f"商品 {row}-{col}")
+            ws.append(values)
+    wb.save(path)
+
+
+def time_scan(file_path: str, sheets_to_process, scan_engine: str):
+    """
+    使用指定扫描引擎生成下载计划
+    :return: (耗时秒数, 命中列表)
+    """
+    embedder = ExcelImageEmbedder(scan_engine=scan_engine)
+    try:
+        start = time.perf_counter()
+        plan = embedder.plan_batch([file_path], {os.path.basename(file_path): sheets_to_process})
+        elapsed = time.perf_counter() - start
+    finally:
+        embedder.close()
+    return elapsed, plan.file_hits.get(file_path, [])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="对比 openpyxl iter_rows 扫描与列式扫描的图片URL检测耗时")
+    parser.add_argument('--file', help='使用已有工作簿，不指定时生成合成工作簿')
+    parser.add_argument('--rows', type=int, default=100000, help='合成工作簿每个 sheet 的行数（默认 100000）')
+    parser.add_argument('--cols', type=int, default=10, help='合成工作簿的列数（默认 10）')
+    parser.add_argument('--sheets', type=int, default=1, help='合成工作簿的 sheet 数量（默认 1）')
+    parser.add_argument('--url-ratio', type=float, default=0.05, help='图片URL单元格比例（默认 0.05）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子（默认 0）')
+    parser.add_argument('--repeat', type=int, default=3, help='每个引擎重复次数，取最短耗时（默认 3）')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    temp_dir = None
+    file_path = args.file
+    if not file_path:
+        temp_dir = tempfile.TemporaryDirectory()
+        file_path = os.path.join(temp_dir.name, "benchmark.xlsx")
+        start = time.perf_counter()
+        generate_workbook(file_path, args.rows, args.cols, args.url_ratio, args.sheets, args.seed)
+        print(f"生成 {args.sheets} x {args.rows} x {args.cols} 工作簿耗时 {time.perf_counter() - start:.2f}s，"
+              f"大小 {os.path.getsize(file_path) / (1024 * 1024):.2f} MB")
+    try:
+        sheets_to_process = list(range(args.sheets))
+        results = {}
+        for scan_engine in (SCAN_ENGINE_OPENPYXL, SCAN_ENGINE_COLUMNAR):
+            timings = []
+            for _ in range(max(1, args.repeat)):
+                elapsed, hits = time_scan(file_path, sheets_to_process, scan_engine)
+                timings.append(elapsed)
+            results[scan_engine] = (min(timings), hits)
+            print(f"{scan_engine:>8}: {min(timings):.3f}s（{len(hits)} 个命中）")
+
+        openpyxl_time, openpyxl_hits = results[SCAN_ENGINE_OPENPYXL]
+        columnar_time, columnar_hits = results[SCAN_ENGINE_COLUMNAR]
+        if openpyxl_hits != columnar_hits:
+            missing = set(openpyxl_hits) - set(columnar_hits)
+            extra = set(columnar_hits) - set(openpyxl_hits)
+            print(f"结果不一致：列式扫描缺少 {len(missing)} 个、多出 {len(extra)} 个命中，"
+                  f"例如 {sorted(missing)[:3]} / {sorted(extra)[:3]}")
+            return 1
+        print(f"结果一致，列式扫描加速 {openpyxl_time / columnar_time:.1f}x")
+        return 0
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
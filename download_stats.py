@@ -0,0 +1,109 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+from latency_tracker import percentile
+
+
+def format_bytes(num_bytes: int) -> str:
+    """将字节数格式化为 MB 字符串。"""
+    return f"{num_bytes / (1024 * 1024):.2f} MB"
+
+
+class DownloadStats:
+    """
+    单次运行的下载统计，线程安全。
+    同时负责整次运行的字节预算：所有下载线程共享同一个预算。
+    """
+
+    def __init__(self, max_run_bytes: Optional[int] = None):
+        """
+        :param max_run_bytes: 本次运行允许下载的最大字节数，None 表示不限制
+        """
+        self.max_run_bytes = max_run_bytes
+        self.bytes_read = 0
+        self.downloaded_bytes = 0
+        self.downloaded_count = 0
+        self.aborted_bytes = 0
+        self.aborted_count = 0
+        self.negative_skipped = 0
+        self.hedged_count = 0
+        self.hedge_wins = 0
+        self._latencies: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def reserve(self, num_bytes: int) -> bool:
+        """
+        记录已读取的字节并检查运行预算（中止的下载同样计入预算）
+        :param num_bytes: 新读取的字节数
+        :return: 未超出运行预算返回 True，否则返回 False
+        """
+        with self._lock:
+            self.bytes_read += num_bytes
+            return self.max_run_bytes is None or self.bytes_read <= self.max_run_bytes
+
+    def remaining_bytes(self) -> Optional[int]:
+        """运行预算剩余字节数，不限制时返回 None。"""
+        with self._lock:
+            if self.max_run_bytes is None:
+                return None
+            return max(0, self.max_run_bytes - self.bytes_read)
+
+    def record_download(self, num_bytes: int) -> None:
+        """记录一张成功写入缓存的图片及其大小。"""
+        with self._lock:
+            self.downloaded_count += 1
+            self.downloaded_bytes += num_bytes
+
+    def record_abort(self, num_bytes: int) -> None:
+        """记录一次中止的下载及其已读取的字节数。"""
+        with self._lock:
+            self.aborted_count += 1
+            self.aborted_bytes += num_bytes
+
+    def record_negative_skip(self) -> None:
+        """记录一次因失效链接缓存而跳过的下载。"""
+        with self._lock:
+            self.negative_skipped += 1
+
+    def record_latency(self, host: str, seconds: float) -> None:
+        """记录一次成功下载的耗时。"""
+        with self._lock:
+            self._latencies.append((host, seconds))
+
+    def record_hedge(self) -> None:
+        """记录一次对冲请求。"""
+        with self._lock:
+            self.hedged_count += 1
+
+    def record_hedge_win(self) -> None:
+        """记录一次对冲请求先于原请求完成。"""
+        with self._lock:
+            self.hedge_wins += 1
+
+    def latency_summary(self, slowest_hosts: int = 3) -> str:
+        """
+        返回下载耗时的 p50/p95/p99 以及 p95 最慢的主机，没有样本时返回空字符串
+        :param slowest_hosts: 列出的最慢主机数
+        """
+        with self._lock:
+            latencies = list(self._latencies)
+            hedged_count, hedge_wins = self.hedged_count, self.hedge_wins
+        if not latencies:
+            return ""
+        values = [seconds for _, seconds in latencies]
+        by_host: Dict[str, List[float]] = {}
+        for host, seconds in latencies:
+            by_host.setdefault(host, []).append(seconds)
+        host_p95 = sorted(((percentile(samples, 95), host, len(samples)) for host, samples in by_host.items()),
+                          reverse=True)[:slowest_hosts]
+        hosts = "，".join(f"{host} p95 {p95:.2f}s ({count} 次)" for p95, host, count in host_p95)
+        return (f"p50 {percentile(values, 50):.2f}s / p95 {percentile(values, 95):.2f}s / "
+                f"p99 {percentile(values, 99):.2f}s（{len(values)} 次），"
+                f"对冲请求 {hedged_count} 次（胜出 {hedge_wins} 次）；最慢主机: {hosts}")
+
+    def summary(self) -> str:
+        """返回用于运行总结日志的统计描述。"""
+        with self._lock:
+            return (f"下载 {self.downloaded_count} 张（{format_bytes(self.downloaded_bytes)}），"
+                    f"共读取 {format_bytes(self.bytes_read)}，"
+                    f"中止 {self.aborted_count} 张（已读取 {format_bytes(self.aborted_bytes)}），"
+                    f"跳过已知失效链接 {self.negative_skipped} 个")
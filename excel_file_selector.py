@@ -6,6 +6,9 @@ from PyQt6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QTreeWidget, QTre
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
 from custom_log_config import CustomHandler
 from excel_image_embedder import ExcelImageEmbedder
+from pipeline_tracer import PipelineTracer
+from image_prefetcher import ImagePrefetcher
+from image_cache import release_process_locks
 import logging
 from openpyxl.utils.exceptions import InvalidFileException
 
@@ -23,13 +26,21 @@ class Worker(QThread):
     error = pyqtSignal(str)
     finished = pyqtSignal()
 
-    def __init__(self, file_sheet_map: Dict, embedder_class):
+    def __init__(self, file_sheet_map: Dict, embedder_class, trace_path: Optional[str] = None,
+                 prefetcher: Optional[ImagePrefetcher] = None, retry_failed: bool = False,
+                 hedge_requests: bool = False, download_options: Optional[Dict] = None):
         super().__init__()
         self.file_sheet_map = file_sheet_map
+        self.download_options = dict(download_options or {})
         self.embedder_class = embedder_class
+        self.trace_path = trace_path
+        self.prefetcher = prefetcher
+        self.retry_failed = retry_failed
+        self.hedge_requests = hedge_requests
 
     def run(self):
         """在工作线程中运行图片嵌入过程。"""
+        embedder = None
         try:
             logging.debug(f"Worker 线程启动，file_sheet_map: {self.file_sheet_map}")
             if not self.file_sheet_map:
@@ -38,6 +49,8 @@ class Worker(QThread):
                 self.finished.emit()
                 return
 
+            file_paths: List[str] = []
+            sheets_to_process_map: Dict[str, List[int]] = {}
             for file_path, info in self.file_sheet_map.items():
                 file_name = info.get("file_name", "")
                 sheet_indices = info.get("sheet_indices", [])
@@ -55,20 +68,40 @@ class Worker(QThread):
                     self.progress.emit(f"文件 {file_name} 未选择 sheet，跳过。")
                     continue
 
-                self.progress.emit(f"正在处理文件: {file_name}, sheet 索引: {sheet_indices}")
-                embedder = self.embedder_class()
+                self.progress.emit(f"待处理文件: {file_name}, sheet 索引: {sheet_indices}")
+                file_paths.append(file_path)
+                sheets_to_process_map[file_name] = sheet_indices
+
+            if self.prefetcher:
+                # 停止预取并等待其退出，已预热的图片会直接命中缓存
+                self.prefetcher.cancel()
+                if not self.prefetcher.join():
+                    logging.warning("后台预取未能在时限内退出，其正在下载的图片会在预取超时后再由本次处理下载。")
+                    self.progress.emit("警告：后台预取仍在退出，部分图片需等待其超时后下载。")
+
+            if file_paths:
+                # 整个批次交给同一个嵌入器：先扫描全部文件，去重后每个 URL 只下载一次
+                tracer = PipelineTracer() if self.trace_path else None
+                embedder_kwargs = dict(self.download_options)
+                if tracer:
+                    embedder_kwargs["tracer"] = tracer
+                if self.retry_failed:
+                    embedder_kwargs["retry_failed"] = True
+                if self.hedge_requests:
+                    embedder_kwargs["hedge_requests"] = True
+                embedder = self.embedder_class(**embedder_kwargs)
                 try:
-                    logging.debug(f"调用 embed_images for {file_name}")
+                    logging.debug(f"调用 embed_images for {list(sheets_to_process_map)}")
                     embedder.embed_images(
-                        [file_path],
-                        {file_name: sheet_indices},
+                        file_paths,
+                        sheets_to_process_map,
                         progress_callback=self.progress.emit
                     )
-                    self.progress.emit(f"文件 {file_name} 处理完成。")
                 except Exception as e:
-                    logging.error(f"embed_images 处理 {file_name} 失败: {str(e)}", exc_info=True)
-                    self.error.emit(f"处理文件 {file_name} 时发生错误: {str(e)}")
-                    continue
+                    logging.error(f"embed_images 处理批次失败: {str(e)}", exc_info=True)
+                    self.error.emit(f"处理文件时发生错误: {str(e)}")
+                if tracer:
+                    tracer.export(self.trace_path)
 
             self.progress.emit("所有选中的文件处理完成。")
             self.finished.emit()
@@ -80,11 +113,22 @@ class Worker(QThread):
             logging.error(f"处理图片时发生意外错误: {str(e)}", exc_info=True)
             self.error.emit(f"处理图片时发生意外错误: {str(e)}")
             self.finished.emit()
+        finally:
+            if embedder is not None:
+                embedder.close()
 
 
 class ExcelFileSelector(QWidget):
-    def __init__(self, embedder_class=None):
+    def __init__(self, embedder_class=None, trace_path: Optional[str] = None, prefetch: bool = True,
+                 retry_failed: bool = False, hedge_requests: bool = False,
+                 download_options: Optional[Dict] = None):
         super().__init__()
+        self.trace_path = trace_path
+        self.download_options = dict(download_options or {})
+        self.retry_failed = retry_failed
+        self.hedge_requests = hedge_requests
+        self.prefetch_enabled = prefetch
+        self.prefetcher: Optional[ImagePrefetcher] = None
         self.selected_file_paths: List[str] = []
         self.browse_button: Optional[QPushButton] = None
         self.file_tree: Optional[QTreeWidget] = None
@@ -108,6 +152,7 @@ class ExcelFileSelector(QWidget):
         self.file_tree = QTreeWidget(self)
         self.file_tree.setHeaderLabels(["文件信息"])
         self.file_tree.setSelectionMode(QTreeWidget.SelectionMode.ExtendedSelection)
+        self.file_tree.itemSelectionChanged.connect(self.update_prefetch_selection)
         layout.addWidget(self.file_tree, stretch=0.3)
         self.process_images_button = QPushButton("处理图片", self)
         self.process_images_button.setFixedSize(*PROCESS_BUTTON_SIZE)
@@ -168,6 +213,7 @@ class ExcelFileSelector(QWidget):
                     root_item.addChild(child_item)
             self.file_tree.expandAll()
             logging.info("文件和 sheet 信息已加载到文件树。")
+            self.start_prefetch(file_paths)
 
         except Exception as e:
             logging.error(f"浏览文件时发生错误: {e}")
@@ -191,7 +237,9 @@ class ExcelFileSelector(QWidget):
                 return
 
             logging.info(f"将处理以下文件和 sheet: {file_sheet_map}")
-            self.worker = Worker(file_sheet_map, self.embedder_class)
+            self.worker = Worker(file_sheet_map, self.embedder_class, self.trace_path, self.prefetcher,
+                                 self.retry_failed, self.hedge_requests, self.download_options)
+            self.prefetcher = None
             self.worker.progress.connect(self.append_log_message)
             self.worker.error.connect(self.handle_worker_error)
             self.worker.finished.connect(self.handle_worker_finished)
@@ -202,6 +250,30 @@ class ExcelFileSelector(QWidget):
             QMessageBox.critical(self, "错误", f"启动处理线程时发生错误: {e}")
             self.process_images_button.setEnabled(True)
 
+    def start_prefetch(self, file_paths: List[str]) -> None:
+        """在后台开始预取新添加文件中的图片，取消之前的预取。"""
+        self.cancel_prefetch()
+        if not self.prefetch_enabled:
+            return
+        self.prefetcher = ImagePrefetcher(file_paths, download_options=self.download_options)
+        self.prefetcher.start()
+        logging.info("已在后台开始预取图片，选择 sheet 期间会预热图片缓存。")
+
+    def cancel_prefetch(self) -> None:
+        """取消正在进行的预取。"""
+        if self.prefetcher:
+            self.prefetcher.cancel()
+            self.prefetcher = None
+
+    def update_prefetch_selection(self) -> None:
+        """用户选择变化时，优先预取已选中 sheet 中的图片。"""
+        if not self.prefetcher:
+            return
+        try:
+            self.prefetcher.update_selection(self.get_file_sheet_map(self.file_tree.selectedItems()))
+        except Exception as e:
+            logging.error(f"更新预取优先级失败: {e}")
+
     def handle_worker_error(self, error_msg: str) -> None:
         """处理工作线程中的错误。"""
         logging.error(error_msg)
@@ -286,9 +358,12 @@ class ExcelFileSelector(QWidget):
 
     def closeEvent(self, event) -> None:
         """处理窗口关闭事件。"""
+        self.cancel_prefetch()
         if self.worker and self.worker.isRunning():
             self.worker.terminate()
             self.worker.wait()
+            # 被终止的线程不会释放它持有的缓存条目锁
+            release_process_locks()
         if self.custom_log_handler:
             self.custom_log_handler.close()
         logging.info("应用正在关闭。")
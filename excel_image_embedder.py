@@ -1,4 +1,6 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 
 import pandas
 import pandas as pd
@@ -7,28 +9,233 @@ from openpyxl.drawing.image import Image
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from urllib3.exceptions import NameResolutionError, NewConnectionError, ReadTimeoutError, ConnectTimeoutError
 import time
 import logging
-import hashlib
 import re
-from typing import List, Dict, Set, Optional, Callable, Tuple
+from urllib.parse import urlparse
+from collections import Counter
+from typing import List, Dict, Optional, Callable, Tuple
 from PIL import Image as PILImage
 from PIL import UnidentifiedImageError
 from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.utils.exceptions import InvalidFileException
+from image_cache import ImageCache, CacheEntryLock, IMAGE_URL_REGEX
+from columnar_url_scanner import (scan_image_urls, selected_sheets_xml_size, ColumnarScanError,
+                                  COLUMNAR_SCAN_THRESHOLD_BYTES)
+from download_stats import DownloadStats, format_bytes
+from pipeline_tracer import PipelineTracer
+from bandwidth_limiter import BandwidthLimiter
+from latency_tracker import LatencyTracker
+from negative_cache import (NegativeCache, NEGATIVE_CACHE_FILENAME, FAILURE_HTTP_NOT_FOUND, FAILURE_HTTP_CLIENT,
+                            FAILURE_HTTP_SERVER, FAILURE_HTTP_TRANSIENT, FAILURE_DNS, FAILURE_CONNECT,
+                            FAILURE_TIMEOUT, FAILURE_INVALID_IMAGE, FAILURE_TOO_LARGE)
 
 # Maximum file count
 MAX_FILE_COUNT = 10
 MAX_TOTAL_SIZE = 500 * 1024 * 1024
 MAX_CONCURRENT_DOWNLOADS = 3
 
-# 支持的图片扩展名常量
-SUPPORTED_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.svg', '.webp')
+# 下载字节限制
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+MAX_RUN_BYTES = 2 * 1024 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
+# 下载时限（秒）：连接超时、两次读取之间的超时、单次下载尝试（含重试）的总时限
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 10.0
+TOTAL_TIMEOUT = 30.0
+
+# 请求重试：连接/读取失败或以下状态码时按指数退避重试，重试不会越过总时限
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF_FACTOR = 1.0
+RETRY_STATUS_CODES = (502, 503, 504)
+RETRY_POLL_INTERVAL = 0.2
+
+# 对冲请求：超过主机该分位耗时仍未完成时发起第二个请求
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_DELAY = 0.2
+# 非图片 Content-Type 中允许的通用二进制类型
+ALLOWED_NON_IMAGE_CONTENT_TYPES = ('application/octet-stream', 'binary/octet-stream')
+
+# 扫描引擎：auto 按选定 sheets 的大小在 openpyxl 与列式扫描之间自动选择
+SCAN_ENGINE_AUTO = "auto"
+SCAN_ENGINE_OPENPYXL = "openpyxl"
+SCAN_ENGINE_COLUMNAR = "columnar"
+SCAN_ENGINES = (SCAN_ENGINE_AUTO, SCAN_ENGINE_OPENPYXL, SCAN_ENGINE_COLUMNAR)
+
+# 输出目录
+OUTPUT_DIR = "excel_with_images"
+
+# 单元格命中：(sheet_index, row_index, col_index, url)，行列均为 0-based
+ImageCellHit = Tuple[int, int, int, str]
+
+
+class BatchDownloadPlan:
+    """
+    批次下载计划：批次内所有文件去重后的 URL 集合及其引用计数，
+    以及每个文件需要嵌入图片的单元格。每个 URL 只下载一次，结果分发给所有引用它的文件。
+    """
 
-class ExcelImageEmbedder:
     def __init__(self):
-        self._successfully_downloaded_urls: Set[str] = set()
+        self.url_save_path_map: Dict[str, str] = {}
+        self.url_ref_counts: Counter = Counter()
+        self.file_hits: Dict[str, List[ImageCellHit]] = {}
+
+    def add_file(self, file_path: str, hits: List[ImageCellHit], path_for: Callable[[str], str]) -> None:
+        """
+        登记一个文件的扫描结果
+        :param file_path: 文件路径
+        :param hits: 单元格命中列表
+        :param path_for: URL 到缓存路径的映射函数
+        """
+        self.file_hits[file_path] = hits
+        for url in {hit[3] for hit in hits}:
+            self.url_ref_counts[url] += 1
+            if url not in self.url_save_path_map:
+                self.url_save_path_map[url] = path_for(url)
+
+    @property
+    def total_references(self) -> int:
+        """所有文件中包含图片链接的单元格总数。"""
+        return sum(len(hits) for hits in self.file_hits.values())
+
+    @property
+    def shared_url_count(self) -> int:
+        """被多个文件引用的 URL 数量。"""
+        return sum(1 for count in self.url_ref_counts.values() if count > 1)
+
+    def ordered_url_save_path_map(self) -> Dict[str, str]:
+        """按引用文件数从多到少排序的 URL 到保存路径映射，优先下载被共享的图片。"""
+        return {url: self.url_save_path_map[url]
+                for url, _ in sorted(self.url_ref_counts.items(), key=lambda item: -item[1])}
+
+
+class DownloadAborted(Exception):
+    """下载因超出字节限制或响应头不符合要求而提前中止。"""
+
+    def __init__(self, reason: str, bytes_read: int = 0, failure_class: Optional[str] = None):
+        """
+        :param reason: 中止原因
+        :param bytes_read: 中止前已读取的字节数
+        :param failure_class: 需要记入失效链接缓存的失败类别；预算用尽或取消等与链接本身无关的中止为 None
+        """
+        super().__init__(reason)
+        self.reason = reason
+        self.bytes_read = bytes_read
+        self.failure_class = failure_class
+
+
+class ExcelImageEmbedder:
+    def __init__(self, image_cache: Optional[ImageCache] = None,
+                 max_workers: int = MAX_CONCURRENT_DOWNLOADS,
+                 max_image_bytes: Optional[int] = MAX_IMAGE_BYTES,
+                 max_run_bytes: Optional[int] = MAX_RUN_BYTES,
+                 chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                 head_precheck: bool = False,
+                 tracer: Optional[PipelineTracer] = None,
+                 rate_limiter: Optional[BandwidthLimiter] = None,
+                 cancel_event: Optional[threading.Event] = None,
+                 negative_cache: Optional[NegativeCache] = None,
+                 retry_failed: bool = False,
+                 connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT,
+                 total_timeout: float = TOTAL_TIMEOUT,
+                 hedge_requests: bool = False,
+                 latency_tracker: Optional[LatencyTracker] = None,
+                 scan_engine: str = SCAN_ENGINE_AUTO,
+                 columnar_threshold_bytes: int = COLUMNAR_SCAN_THRESHOLD_BYTES):
+        """
+        :param image_cache: 共享的图片缓存，默认新建
+        :param max_workers: 并发下载线程数
+        :param max_image_bytes: 单张图片允许的最大字节数，None 表示不限制
+        :param max_run_bytes: 单次运行允许下载的最大字节数，None 表示不限制
+        :param chunk_size: 流式读取响应体的块大小
+        :param head_precheck: 是否在 GET 之前先发送 HEAD 请求检查响应头
+        :param tracer: 时间线记录器，默认不记录
+        :param rate_limiter: 共享的带宽限制器，默认不限速
+        :param cancel_event: 设置后正在进行的下载尽快中止（用于可取消的预取）
+        :param negative_cache: 失效链接缓存，默认使用缓存目录下的 negative_cache.json
+        :param retry_failed: 是否忽略失效链接缓存，强制重试已知失败的链接
+        :param connect_timeout: 连接超时（秒）
+        :param read_timeout: 读取超时（秒），即两次收到数据之间的最长间隔
+        :param total_timeout: 单次下载尝试的总时限（秒），包括请求重试和退避等待
+        :param hedge_requests: 是否对慢于主机 p95 耗时的下载发起对冲请求
+        :param latency_tracker: 按主机记录下载耗时，默认新建
+        :param scan_engine: 扫描引擎，auto / openpyxl / columnar
+        :param columnar_threshold_bytes: auto 模式下选定 sheets 的 XML 超过该大小时使用列式扫描
+        """
+        if scan_engine not in SCAN_ENGINES:
+            raise ValueError(f"未知的扫描引擎: {scan_engine}")
+        self.scan_engine = scan_engine
+        self.columnar_threshold_bytes = columnar_threshold_bytes
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.hedge_requests = hedge_requests
+        self._latency_tracker = latency_tracker or LatencyTracker()
+        self.rate_limiter = rate_limiter
+        self.cancel_event = cancel_event
+        self.tracer = tracer or PipelineTracer(enabled=False)
+        self.max_image_bytes = max_image_bytes
+        self.max_run_bytes = max_run_bytes
+        self.chunk_size = max(1024, chunk_size)
+        self.head_precheck = head_precheck
+        self._image_cache = image_cache if image_cache is not None else ImageCache()
+        self._negative_cache = negative_cache if negative_cache is not None else NegativeCache(
+            os.path.join(self._image_cache.cache_dir, NEGATIVE_CACHE_FILENAME))
+        self.retry_failed = retry_failed
+        if retry_failed:
+            # 强制重试：清空旧的失败记录，本次运行的结果重新写入
+            self._negative_cache.clear()
+        self._max_workers = max(1, max_workers)
+        self._session = self._create_session(self._max_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @staticmethod
+    def _create_session(pool_size: int) -> requests.Session:
+        """
+        创建 Session，在多次下载之间复用连接。
+        重试不交给 urllib3（其重试不受总时限约束），由 _get_with_deadline 在总时限内进行
+        :param pool_size: 每个主机的连接池大小
+        :return: requests.Session
+        """
+        session = requests.Session()
+        retries = Retry(total=0, read=False)
+        adapter = HTTPAdapter(max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """返回共享的下载线程池，首次使用时创建。"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                    thread_name_prefix="image-download")
+            return self._executor
+
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        """返回执行对冲尝试的线程池，与下载线程池分开以免互相等待。"""
+        with self._executor_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=self._max_workers * 2,
+                                                          thread_name_prefix="image-hedge")
+            return self._hedge_executor
+
+    def close(self) -> None:
+        """关闭下载线程池和 Session，并保存失效链接缓存。"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            if self._hedge_executor is not None:
+                self._hedge_executor.shutdown(wait=True)
+                self._hedge_executor = None
+        self._session.close()
+        self._negative_cache.save()
 
     @staticmethod
     def is_image_url(value: str) -> bool:
@@ -40,18 +247,41 @@ class ExcelImageEmbedder:
 
         if not isinstance(value, str):
             return False
-        ext_pattern = '|'.join(ext[1:] for ext in SUPPORTED_IMAGE_EXTENSIONS)  # 去掉点号
-        pattern = rf'^(https?://).*\.({ext_pattern})$'
-        print(value, "-------->", bool(re.match(pattern, value.lower())))
-        return bool(re.match(pattern, value.lower()))
+        return bool(re.match(IMAGE_URL_REGEX, value.lower()))
+
+    def _check_response_headers(self, headers, stats: DownloadStats) -> None:
+        """
+        在读取响应体之前检查 Content-Type 和 Content-Length
+        :param headers: 响应头
+        :param stats: 本次运行的下载统计
+        :raises DownloadAborted: 响应头表明不是图片或超出字节限制
+        """
+        content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type and not content_type.startswith('image/') \
+                and content_type not in ALLOWED_NON_IMAGE_CONTENT_TYPES:
+            raise DownloadAborted(f"Content-Type 为 {content_type}，不是图片", failure_class=FAILURE_INVALID_IMAGE)
 
-    def _download_image(self, url: str, save_path: str) -> Optional[str]:
+        content_length = headers.get('Content-Length')
+        if content_length is None or not content_length.isdigit():
+            return
+        content_length = int(content_length)
+        if self.max_image_bytes is not None and content_length > self.max_image_bytes:
+            raise DownloadAborted(f"Content-Length {format_bytes(content_length)} "
+                                  f"超过单张图片上限 {format_bytes(self.max_image_bytes)}",
+                                  failure_class=FAILURE_TOO_LARGE)
+        remaining = stats.remaining_bytes()
+        if remaining is not None and content_length > remaining:
+            raise DownloadAborted(f"Content-Length {format_bytes(content_length)} 超过本次运行剩余预算")
+
+    def _download_image(self, url: str, save_path: str, stats: Optional[DownloadStats] = None) -> Optional[str]:
         """
         下载图片并保存到指定路径
         :param url: 图片URL
         :param save_path: 保存路径
+        :param stats: 本次运行的下载统计（含运行字节预算）
         :return: 保存路径如果下载成功，否则返回 None
         """
+        stats = stats or DownloadStats(self.max_run_bytes)
         save_dir = os.path.dirname(save_path)
         if not os.path.exists(save_dir):
             try:
@@ -64,66 +294,333 @@ class ExcelImageEmbedder:
             logging.error(f"目录 {save_dir} 不可写。")
             return None
 
-        if os.path.exists(save_path):
-            try:
-                PILImage.open(save_path).verify()
-                self._successfully_downloaded_urls.add(url)
-                logging.debug(f"图片 {url} 已存在于 {save_path}，跳过下载。")
-                return save_path
-            except UnidentifiedImageError:
-                logging.warning(f"图片 {save_path} 存在但损坏，重新下载。")
-                os.remove(save_path)
+        with self.tracer.span("cache_lookup", "download", url=url):
+            cached_path = self._image_cache.lookup(url, save_path)
+        if cached_path:
+            logging.debug(f"图片 {url} 已存在于 {save_path}，跳过下载。")
+            return cached_path
 
-        try:
-            session = requests.Session()
-            retries = Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504])
-            session.mount('http://', HTTPAdapter(max_retries=retries))
-            session.mount('https://', HTTPAdapter(max_retries=retries))
+        if self._is_cancelled():
+            return None
 
-            response = session.get(url, stream=True, timeout=10)
-            response.raise_for_status()
+        if not self.retry_failed:
+            failure = self._negative_cache.get(url)
+            if failure:
+                stats.record_negative_skip()
+                logging.debug(f"图片 {url} 近期下载失败 ({failure['class']})，跳过。")
+                return None
 
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            with open(save_path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
+        if stats.remaining_bytes() == 0:
+            logging.warning(f"本次运行下载预算已用完，跳过图片 {url}")
+            stats.record_abort(0)
+            return None
+
+        try:
+            with self.tracer.span("cache_lock", "download", url=url):
+                entry_lock = self._image_cache.acquire(url, save_path, self.cancel_event)
+        except OSError as e:
+            logging.error(f"获取图片 {url} 的缓存锁失败: {e}")
+            return None
+        if entry_lock is None:
+            # 等待期间其他进程/线程已写入该条目，或等待被取消
+            cached_path = self._image_cache.lookup(url, save_path)
+            if cached_path:
+                logging.debug(f"图片 {url} 已由其他进程下载到 {save_path}。")
+            return cached_path
+        try:
+            # 获得锁后再检查一次，锁可能刚由其他下载者释放
+            cached_path = self._image_cache.lookup(url, save_path)
+            if cached_path:
+                return cached_path
+            if not self.retry_failed:
+                # 等待期间的持有者下载失败时复用其结果，不再请求同一个失效链接
+                failure = self._negative_cache.get(url)
+                if failure is None and entry_lock.waited:
+                    failure = self._image_cache.read_failure(save_path)
+                if failure:
+                    stats.record_negative_skip()
+                    logging.debug(f"图片 {url} 刚由其他下载者下载失败 ({failure['class']})，跳过。")
+                    return None
+            result = self._fetch_image(url, save_path, stats, entry_lock)
+            if result is None:
+                failure = self._negative_cache.get(url)
+                if failure:
+                    self._image_cache.record_failure(save_path, failure)
+            return result
+        finally:
+            entry_lock.release()
+
+    def _fetch_image(self, url: str, save_path: str, stats: DownloadStats,
+                     entry_lock: CacheEntryLock) -> Optional[str]:
+        """
+        持有条目锁时下载图片：先写入临时文件，校验通过后原子重命名为缓存文件
+        :param url: 图片URL
+        :param save_path: 缓存文件路径
+        :param stats: 本次运行的下载统计（含运行字节预算）
+        :param entry_lock: 已持有的条目锁，下载期间刷新心跳
+        :return: 保存路径如果下载成功，否则返回 None
+        """
+        temp_path = None
+        try:
+            temp_path = self._run_fetch_attempts(url, save_path, stats, entry_lock)
 
             try:
-                PILImage.open(save_path).verify()
-                self._successfully_downloaded_urls.add(url)
-                logging.debug(f"图片 {url} 下载成功，保存到 {save_path}")
-                return save_path
-            except UnidentifiedImageError:
-                logging.error(f"下载的图片 {url} 无效，删除文件 {save_path}")
-                try:
-                    os.remove(save_path)
-                except OSError as e:
-                    logging.error(f"删除无效图片文件 {save_path} 失败: {e}")
+                with self.tracer.span("probe", "image", url=url):
+                    with PILImage.open(temp_path) as img:
+                        img.verify()
+            except (UnidentifiedImageError, SyntaxError):
+                logging.error(f"下载的图片 {url} 无效，删除临时文件 {temp_path}")
+                self._negative_cache.record(url, FAILURE_INVALID_IMAGE)
+                self._remove_partial_file(temp_path)
                 return None
 
-        except requests.exceptions.Timeout:
+            image_bytes = os.path.getsize(temp_path)
+            self._image_cache.commit(url, temp_path, save_path)
+            stats.record_download(image_bytes)
+            self._negative_cache.discard(url)
+            logging.debug(f"图片 {url} 下载成功，保存到 {save_path}")
+            return save_path
+
+        except DownloadAborted as aborted:
+            stats.record_abort(aborted.bytes_read)
+            logging.warning(f"中止下载图片 {url}: {aborted.reason}")
+            if aborted.failure_class:
+                self._negative_cache.record(url, aborted.failure_class, aborted.reason)
+            self._remove_partial_file(temp_path)
+            return None
+        except requests.exceptions.Timeout as timeout_err:
             logging.error(f"下载图片 {url} 时发生超时错误。")
+            self._negative_cache.record(url, FAILURE_TIMEOUT, str(timeout_err))
+            self._remove_partial_file(temp_path)
             return None
         except requests.exceptions.HTTPError as http_err:
             logging.error(f"下载图片 {url} 时发生HTTP错误: {http_err}")
+            self._negative_cache.record(url, self._classify_http_error(http_err), str(http_err))
+            return None
+        except requests.exceptions.ConnectionError as conn_err:
+            logging.error(f"下载图片 {url} 失败: {conn_err}")
+            self._negative_cache.record(url, self._classify_connection_error(conn_err), str(conn_err))
+            self._remove_partial_file(temp_path)
             return None
         except requests.exceptions.RequestException as req_err:
-            logging.error(f"下载图片 {url} 失败: {e}")
-            if os.path.exists(save_path):
-                try:
-                    os.remove(save_path)
-                except OSError as remove_err:
-                    logging.error(f"删除文件 {save_path} 失败: {remove_err}")
+            logging.error(f"下载图片 {url} 失败: {req_err}")
+            self._remove_partial_file(temp_path)
             return None
         except OSError as e:
             logging.error(f"下载图片 {url} 失败: {e}")
-            if os.path.exists(save_path):
-                try:
-                    os.remove(save_path)
-                except OSError as remove_err:
-                    logging.error(f"删除文件 {save_path} 失败: {remove_err}")
+            self._remove_partial_file(temp_path)
             return None
 
+    def _is_cancelled(self, attempt_cancel: Optional[threading.Event] = None) -> bool:
+        """是否已请求取消下载（整体取消或本次尝试被取消）。"""
+        return ((self.cancel_event is not None and self.cancel_event.is_set())
+                or (attempt_cancel is not None and attempt_cancel.is_set()))
+
+    def _run_fetch_attempts(self, url: str, save_path: str, stats: DownloadStats,
+                            entry_lock: CacheEntryLock) -> str:
+        """
+        执行下载。启用对冲请求且该主机已有足够样本时，若首个请求超过该主机的 p95 耗时仍未完成，
+        则再发起一个相同请求，采用先完成的结果并取消另一个
+        :param url: 图片URL
+        :param save_path: 缓存文件路径
+        :param stats: 本次运行的下载统计
+        :param entry_lock: 已持有的条目锁
+        :return: 已写入完整响应体的临时文件路径
+        :raises: 所有尝试都失败时抛出首个请求的异常
+        """
+        host = urlparse(url).hostname or ''
+        hedge_after = self._latency_tracker.percentile(host, HEDGE_PERCENTILE) if self.hedge_requests else None
+        if hedge_after is None:
+            return self._fetch_attempt(url, save_path, stats, entry_lock)
+
+        executor = self._get_hedge_executor()
+        attempts: Dict[Future, threading.Event] = {}
+        primary_cancel = threading.Event()
+        primary = executor.submit(self._fetch_attempt, url, save_path, stats, entry_lock, primary_cancel)
+        attempts[primary] = primary_cancel
+        done, _ = wait([primary], timeout=max(hedge_after, HEDGE_MIN_DELAY))
+        if not done:
+            logging.debug(f"图片 {url} 超过主机 {host} 的 p{HEDGE_PERCENTILE} 耗时 {hedge_after:.2f} 秒，发起对冲请求。")
+            stats.record_hedge()
+            hedge_cancel = threading.Event()
+            hedge = executor.submit(self._fetch_attempt, url, save_path, stats, entry_lock, hedge_cancel)
+            attempts[hedge] = hedge_cancel
+
+        errors: Dict[Future, BaseException] = {}
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = None
+            for future in done:
+                if future.exception() is not None:
+                    errors[future] = future.exception()
+                elif winner is None:
+                    winner = future
+            if winner is None:
+                continue
+            for future, cancel in attempts.items():
+                if future is not winner:
+                    cancel.set()
+                    future.cancel()
+                    future.add_done_callback(self._discard_attempt_result)
+            if winner is not primary:
+                stats.record_hedge_win()
+            return winner.result()
+        raise errors.get(primary) or next(iter(errors.values()))
+
+    def _fetch_attempt(self, url: str, save_path: str, stats: DownloadStats, entry_lock: CacheEntryLock,
+                       attempt_cancel: Optional[threading.Event] = None) -> str:
+        """
+        单次下载尝试：分别限制连接和读取超时，并对整张图片施加总时限
+        :param url: 图片URL
+        :param save_path: 缓存文件路径
+        :param stats: 本次运行的下载统计
+        :param entry_lock: 已持有的条目锁，下载期间刷新心跳
+        :param attempt_cancel: 本次尝试的取消事件（对冲中落败的一方会被取消）
+        :return: 临时文件路径；失败时删除临时文件并抛出异常
+        """
+        start = time.monotonic()
+        deadline = start + self.total_timeout
+        bytes_read = 0
+        temp_path = None
+        try:
+            if self._is_cancelled(attempt_cancel):
+                raise DownloadAborted("下载已取消")
+            if self.head_precheck:
+                head_response = self._session.head(url, timeout=(self.connect_timeout, self.read_timeout),
+                                                   allow_redirects=True)
+                if head_response.ok:
+                    self._check_response_headers(head_response.headers, stats)
+
+            # connect + TTFB：get 在收到响应头后返回（含重试）
+            with self.tracer.span("request", "download", url=url) as span_args:
+                response = self._get_with_deadline(url, deadline, attempt_cancel)
+                span_args["status"] = response.status_code
+            try:
+                response.raise_for_status()
+                self._check_response_headers(response.headers, stats)
+
+                fd, temp_path = self._image_cache.create_temp_file(save_path)
+                with self.tracer.span("body", "download", url=url) as span_args, os.fdopen(fd, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        # 先计入已读取字节，中止时报告的字节数才不会超过运行总读取量
+                        bytes_read += len(chunk)
+                        within_budget = stats.reserve(len(chunk))
+                        if self.max_image_bytes is not None and bytes_read > self.max_image_bytes:
+                            raise DownloadAborted(f"已读取超过单张图片上限 {format_bytes(self.max_image_bytes)}",
+                                                  bytes_read, FAILURE_TOO_LARGE)
+                        if not within_budget:
+                            raise DownloadAborted("超出本次运行下载预算", bytes_read)
+                        if self._is_cancelled(attempt_cancel) or (self.rate_limiter and not self.rate_limiter.consume(
+                                len(chunk), self.cancel_event)):
+                            raise DownloadAborted("下载已取消", bytes_read)
+                        if time.monotonic() > deadline:
+                            raise DownloadAborted(f"超过单张图片总时限 {self.total_timeout:.0f} 秒",
+                                                  bytes_read, FAILURE_TIMEOUT)
+                        file.write(chunk)
+                        entry_lock.refresh()
+                    span_args["bytes"] = bytes_read
+            finally:
+                # 流式响应提前中止时直接关闭连接，不再读取剩余内容
+                response.close()
+        except BaseException:
+            self._remove_partial_file(temp_path)
+            raise
+
+        elapsed = time.monotonic() - start
+        host = urlparse(url).hostname or ''
+        self._latency_tracker.record(host, elapsed)
+        stats.record_latency(host, elapsed)
+        return temp_path
+
+    def _get_with_deadline(self, url: str, deadline: float,
+                           attempt_cancel: Optional[threading.Event] = None) -> requests.Response:
+        """
+        发送流式 GET 请求。连接/读取失败或返回 RETRY_STATUS_CODES 时按指数退避重试，
+        每次请求的超时和退避等待都不超过剩余的总时限
+        :param url: 图片URL
+        :param deadline: 本次下载尝试的截止时间（time.monotonic）
+        :param attempt_cancel: 本次尝试的取消事件
+        :return: 响应（状态码由调用方检查）
+        :raises DownloadAborted: 超过总时限或被取消
+        """
+        retries = 0
+        while True:
+            # 每次请求前都检查取消（第一次重试没有退避等待），被取消的对冲落败方不再重试
+            if self._is_cancelled(attempt_cancel):
+                raise DownloadAborted("下载已取消")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DownloadAborted(f"超过单张图片总时限 {self.total_timeout:.0f} 秒", failure_class=FAILURE_TIMEOUT)
+            timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+            # urllib3 的退避规则：第一次重试立即进行，之后按 factor * 2^n 等待
+            backoff = DOWNLOAD_BACKOFF_FACTOR * (2 ** retries) if retries else 0.0
+            try:
+                response = self._session.get(url, stream=True, timeout=timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if retries >= DOWNLOAD_RETRIES or time.monotonic() + backoff >= deadline:
+                    raise
+                logging.debug(f"请求图片 {url} 失败，{backoff:.0f} 秒后重试: {e}")
+            else:
+                if (response.status_code not in RETRY_STATUS_CODES or retries >= DOWNLOAD_RETRIES
+                        or time.monotonic() + backoff >= deadline):
+                    return response
+                response.close()
+                logging.debug(f"请求图片 {url} 返回 {response.status_code}，{backoff:.0f} 秒后重试。")
+            retry_at = time.monotonic() + backoff
+            while time.monotonic() < retry_at:
+                if self._is_cancelled(attempt_cancel):
+                    raise DownloadAborted("下载已取消")
+                time.sleep(max(0.0, min(RETRY_POLL_INTERVAL, retry_at - time.monotonic())))
+            retries += 1
+
+    def _discard_attempt_result(self, future: Future) -> None:
+        """删除对冲中落败但仍成功完成的尝试留下的临时文件。"""
+        if not future.cancelled() and future.exception() is None:
+            self._remove_partial_file(future.result())
+
+    def _traced_download_image(self, url: str, save_path: str, stats: DownloadStats) -> Optional[str]:
+        """在时间线中以一个 download 区间包裹单张图片的下载。"""
+        with self.tracer.span("download", "download", url=url, host=urlparse(url).hostname) as span_args:
+            result = self._download_image(url, save_path, stats)
+            span_args["ok"] = result is not None
+        return result
+
+    @staticmethod
+    def _classify_http_error(http_err: requests.exceptions.HTTPError) -> str:
+        """按状态码划分 HTTP 失败类别。408/429 是服务端的临时拒绝，与 5xx 一样很快过期。"""
+        status = http_err.response.status_code if http_err.response is not None else 0
+        if status in (404, 410):
+            return FAILURE_HTTP_NOT_FOUND
+        if status in (408, 429):
+            return FAILURE_HTTP_TRANSIENT
+        if 400 <= status < 500:
+            return FAILURE_HTTP_CLIENT
+        return FAILURE_HTTP_SERVER
+
+    @staticmethod
+    def _classify_connection_error(conn_err: requests.exceptions.ConnectionError) -> str:
+        """区分 DNS 解析失败、重试用尽后的超时（MaxRetryError 包裹的超时）与其他连接失败。"""
+        reason = conn_err.args[0] if conn_err.args else None
+        reason = getattr(reason, 'reason', reason)
+        if isinstance(reason, NameResolutionError):
+            return FAILURE_DNS
+        # urllib3 中 NewConnectionError 继承自 ConnectTimeoutError，需先排除
+        if isinstance(reason, NewConnectionError):
+            return FAILURE_CONNECT
+        if isinstance(reason, (ReadTimeoutError, ConnectTimeoutError)):
+            return FAILURE_TIMEOUT
+        return FAILURE_CONNECT
+
+    @staticmethod
+    def _remove_partial_file(temp_path: Optional[str]) -> None:
+        """删除下载中断时留下的不完整临时文件。"""
+        if temp_path and os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+            except OSError as remove_err:
+                logging.error(f"删除文件 {temp_path} 失败: {remove_err}")
+
     def _embed_image_to_cell(self, ws: Worksheet, img_path: str, row_index: int, col_index: int) -> bool:
         cell_coordinate = f'{chr(65 + col_index)}{row_index + 1}'
         try:
@@ -132,7 +629,7 @@ class ExcelImageEmbedder:
                 return False
 
             # 获取原图尺寸
-            with PILImage.open(img_path) as img:
+            with self.tracer.span("probe", "image", path=img_path), PILImage.open(img_path) as img:
                 original_width, original_height = img.size
 
             # 计算缩放比例，最大尺寸为 100x100，不放大
@@ -206,66 +703,153 @@ class ExcelImageEmbedder:
                 logging.error(f"读取文件 {file_path} 的 sheet 信息出错: {e}")
         return file_sheet_info
 
-    def _collect_image_urls(self, wb, file_basename: str, sheets_to_process: List[int]) -> Dict[str, str]:
+    def _scan_image_cells(self, wb, file_basename: str, sheets_to_process: List[int]) -> List[ImageCellHit]:
         """
-        收集选定sheets中的图片URL
-        :param wb: 工作簿对象
+        扫描选定sheets中包含图片URL的单元格
+        :param wb: 工作簿对象（可为只读模式）
         :param file_basename: 文件名
         :param sheets_to_process: 需要处理的sheet索引列表
-        :return: URL到保存路径的映射
+        :return: 命中列表 [(sheet_index, row_index, col_index, url), ...]，行列均为 0-based
         """
-        urls_to_download: Set[str] = set()
-        url_save_path_map: Dict[str, str] = {}
+        hits: List[ImageCellHit] = []
         sheet_names = wb.sheetnames
 
         logging.info(f"--- 收集文件 {file_basename} 中选定 sheets 的图片链接 ---")
         for sheet_index in sheets_to_process:
+            if self._is_cancelled():
+                logging.info(f"扫描已取消，停止扫描文件 {file_basename}。")
+                break
             if not (0 <= sheet_index < len(sheet_names)):
                 logging.warning(f"文件 {file_basename}: 指定的 Sheet 索引 {sheet_index} (0-based) 不存在，跳过。")
                 continue
             sheet_name = sheet_names[sheet_index]
             logging.debug(f"正在收集 Sheet: {sheet_name} (Index: {sheet_index}) 的链接...")
             ws = wb[sheet_name]
-            for row_index, row in enumerate(ws.iter_rows()):
-                for col_index, cell in enumerate(row):
-                    if self.is_image_url(cell.value):
-                        url = cell.value.strip()
-                        print("1", url)
-                        if url not in urls_to_download:
-                            urls_to_download.add(url)
-                            url_hash = hashlib.md5(url.encode('utf-8')).hexdigest()
-                            ext = os.path.splitext(url.lower())[1]
-                            if not ext or ext not in SUPPORTED_IMAGE_EXTENSIONS:
-                                ext = '.jpg'
-                            img_filename = f"{url_hash}{ext}"
-                            save_path = os.path.join("downloaded_images", img_filename)
-                            url_save_path_map[url] = save_path
-        print("2", url_save_path_map)
-        return url_save_path_map
-
-    def _download_images(self, url_save_path_map: Dict[str, str]) -> Dict[str, Optional[str]]:
-        """
-        顺序下载图片
+            if getattr(ws, 'reset_dimensions', None):
+                # 只读模式下 dimension 标记可能不准确，忽略它以免截断行列
+                ws.reset_dimensions()
+            with self.tracer.span("scan_sheet", "workbook", file=file_basename, sheet=sheet_name) as span_args:
+                hits_before = len(hits)
+                for row in ws.iter_rows():
+                    for cell in row:
+                        if self.is_image_url(cell.value):
+                            hits.append((sheet_index, cell.row - 1, cell.column - 1, cell.value.strip()))
+                span_args["hits"] = len(hits) - hits_before
+        return hits
+
+    def _use_columnar_scan(self, file_path: str, sheets_to_process: List[int]) -> bool:
+        """
+        判断是否使用列式扫描
+        :param file_path: 文件路径
+        :param sheets_to_process: 需要处理的sheet索引列表
+        :return: 使用列式扫描返回 True
+        """
+        if self.scan_engine != SCAN_ENGINE_AUTO:
+            return self.scan_engine == SCAN_ENGINE_COLUMNAR
+        return selected_sheets_xml_size(file_path, sheets_to_process) > self.columnar_threshold_bytes
+
+    def _scan_file(self, file_path: str, sheets_to_process: List[int]) -> List[ImageCellHit]:
+        """
+        扫描单个文件的选定 sheets。大文件使用列式扫描，不支持的工作簿结构回退到 openpyxl 只读扫描
+        :param file_path: 文件路径
+        :param sheets_to_process: 需要处理的sheet索引列表
+        :return: 单元格命中列表
+        """
+        file_basename = os.path.basename(file_path)
+        if self._use_columnar_scan(file_path, sheets_to_process):
+            try:
+                with self.tracer.span("scan_columnar", "scan", file=file_basename) as span_args:
+                    hits = scan_image_urls(file_path, sheets_to_process, self.cancel_event)
+                    span_args["hits"] = len(hits)
+                return hits
+            except ColumnarScanError as e:
+                logging.warning(f"{e}，改用 openpyxl 扫描。")
+        with self.tracer.span("load_workbook", "workbook", file=file_basename, read_only=True):
+            wb = load_workbook(file_path, read_only=True)
+        try:
+            return self._scan_image_cells(wb, file_basename, sheets_to_process)
+        finally:
+            wb.close()
+
+    def plan_batch(self, file_paths: List[str], sheets_to_process_map: Dict[str, List[int]],
+                   progress_callback: Optional[Callable[[str], None]] = None) -> BatchDownloadPlan:
+        """
+        先以只读模式扫描批次中的所有文件，生成去重后的下载计划
+        :param file_paths: 原始文件路径列表
+        :param sheets_to_process_map: 包含需要处理的工作表索引的字典
+        :param progress_callback: Optional callback to report progress
+        :return: BatchDownloadPlan
+        """
+        plan = BatchDownloadPlan()
+        for file_path in file_paths:
+            if self._is_cancelled():
+                logging.info("扫描已取消，停止生成下载计划。")
+                break
+            file_basename = os.path.basename(file_path)
+            sheets_to_process = sheets_to_process_map.get(file_basename, [])
+            if not sheets_to_process:
+                logging.info(f"文件 {file_basename} 没有选定的 sheet 进行处理，跳过。")
+                if progress_callback:
+                    progress_callback(f"文件 {file_basename} 没有选定的 sheet 进行处理，跳过。")
+                continue
+            try:
+                hits = self._scan_file(file_path, sheets_to_process)
+            except FileNotFoundError:
+                logging.error(f"错误: 扫描文件时 {file_path} 未找到。")
+                if progress_callback:
+                    progress_callback(f"错误: 扫描文件时 {file_path} 未找到。")
+                continue
+            except (OSError, InvalidFileException) as e:
+                logging.error(f"扫描文件 {file_path} 时发生错误: {e}")
+                if progress_callback:
+                    progress_callback(f"扫描文件 {file_path} 时发生错误: {str(e)}")
+                continue
+            plan.add_file(file_path, hits, self._image_cache.path_for)
+
+        logging.info(f"--- 批次扫描完成：{len(plan.file_hits)} 个文件共 {plan.total_references} 个图片单元格，"
+                     f"去重后 {len(plan.url_save_path_map)} 个 URL，其中 {plan.shared_url_count} 个被多个文件引用 ---")
+        return plan
+
+    def download_image(self, url: str, save_path: Optional[str] = None,
+                       stats: Optional[DownloadStats] = None) -> Optional[str]:
+        """
+        下载单张图片到共享缓存（供预取等调用方使用）
+        :param url: 图片URL
+        :param save_path: 缓存文件路径，默认按 URL 计算
+        :param stats: 本次运行的下载统计（含运行字节预算）
+        :return: 保存路径如果下载成功，否则返回 None
+        """
+        save_path = save_path or self._image_cache.path_for(url)
+        return self._traced_download_image(url, save_path, stats or DownloadStats(self.max_run_bytes))
+
+    def _download_images(self, url_save_path_map: Dict[str, str],
+                         stats: Optional[DownloadStats] = None) -> Dict[str, Optional[str]]:
+        """
+        使用共享线程池并发下载图片
         :param url_save_path_map: URL到保存路径的映射
+        :param stats: 本次运行的下载统计（含运行字节预算）
         :return: 下载结果映射 {url: save_path or None}
         """
+        stats = stats or DownloadStats(self.max_run_bytes)
         download_results: Dict[str, Optional[str]] = {}
         logging.info(f"--- 开始下载图片 ({len(url_save_path_map)} 张) ---")
-        for url, save_path in url_save_path_map.items():
-            save_path = self._download_image(url, save_path)
-            download_results[url] = save_path
+        executor = self._get_executor()
+        futures = {url: executor.submit(self._traced_download_image, url, save_path, stats)
+                   for url, save_path in url_save_path_map.items()}
+        for url, future in futures.items():
+            download_results[url] = future.result()
         successful_downloads = sum(1 for path in download_results.values() if path is not None)
         failed_downloads = len(url_save_path_map) - successful_downloads
         logging.info(f"--- 图片下载完成：成功 {successful_downloads} 张，失败 {failed_downloads} 张 ---")
         return download_results
 
-    def _embed_images_to_sheets(self, wb, file_basename: str, sheets_to_process: List[int],
+    def _embed_images_to_sheets(self, wb, file_basename: str, hits: List[ImageCellHit],
                                 download_results: Dict[str, Optional[str]]) -> int:
         """
-        将下载的图片嵌入到选定sheets
+        将下载的图片嵌入到扫描命中的单元格
         :param wb: 工作簿对象
         :param file_basename: 文件名
-        :param sheets_to_process: 需要处理的sheet索引列表
+        :param hits: 扫描命中列表 [(sheet_index, row_index, col_index, url), ...]
         :param download_results: 下载结果映射
         :return: 成功嵌入的图片数量
         """
@@ -275,53 +859,56 @@ class ExcelImageEmbedder:
         total_attempted_embeds = 0
         sheet_names = wb.sheetnames
 
-        for sheet_index in sheets_to_process:
-            if not (0 <= sheet_index < len(sheet_names)):
-                continue
-            sheet_name = sheet_names[sheet_index]
-            logging.debug(f"正在嵌入 Sheet: {sheet_name} (Index: {sheet_index}) 的图片...")
-            ws = wb[sheet_name]
-            for row_index, row in enumerate(ws.iter_rows()):
-                for col_index, cell in enumerate(row):
-                    if self.is_image_url(cell.value):
-                        url = cell.value.strip()
-                        total_attempted_embeds += 1
-                        downloaded_path = download_results.get(url)
-                        if downloaded_path and self._embed_image_to_cell(ws, downloaded_path, row_index, col_index):
-                            successful_embeds += 1
-                        else:
-                            logging.error(
-                                f"在单元格 {chr(65 + col_index)}{row_index + 1} 嵌入图片时出错: 图片 {url} 下载失败或嵌入失败。")
-                            failed_embeds += 1
+        for sheet_index, row_index, col_index, url in hits:
+            ws = wb[sheet_names[sheet_index]]
+            total_attempted_embeds += 1
+            downloaded_path = download_results.get(url)
+            if not downloaded_path:
+                embedded = False
+            else:
+                with self.tracer.span("embed", "embed", file=file_basename, row=row_index, col=col_index):
+                    embedded = self._embed_image_to_cell(ws, downloaded_path, row_index, col_index)
+            if embedded:
+                successful_embeds += 1
+            else:
+                logging.error(
+                    f"在单元格 {chr(65 + col_index)}{row_index + 1} 嵌入图片时出错: 图片 {url} 下载失败或嵌入失败。")
+                failed_embeds += 1
 
         logging.info(f"--- 图片嵌入完成：成功 {successful_embeds} 张，失败 {failed_embeds} 张，"
                      f"共检查 {total_attempted_embeds} 个包含图片链接的单元格 ---")
         return successful_embeds
 
-    def _save_output_file(self, wb, file_basename: str) -> None:
+    def _save_output_file(self, wb, file_basename: str) -> bool:
         """
         保存修改后的Excel文件
         :param wb: 工作簿对象
         :param file_basename: 文件名
+        :return: 保存成功返回 True
         """
-        output_dir = "excel_with_images"
+        output_dir = OUTPUT_DIR
         os.makedirs(output_dir, exist_ok=True)
         new_file_name = f"{os.path.splitext(file_basename)[0]}_with_images.xlsx"
         new_file_path = os.path.join(output_dir, new_file_name)
         try:
-            wb.save(new_file_path)
+            with self.tracer.span("save_workbook", "workbook", file=file_basename):
+                wb.save(new_file_path)
             logging.info(f"-> 已保存修改后的文件到 {new_file_path}")
+            return True
         except (OSError, InvalidFileException) as e:
             logging.error(f"保存修改后的文件 {new_file_path} 时出错: {e}")
+            return False
 
     def embed_images(self, file_paths: List[str], sheets_to_process_map: Dict[str, List[int]],
-                     progress_callback: Optional[Callable[[str], None]] = None) -> None:
+                     progress_callback: Optional[Callable[[str], None]] = None,
+                     enforce_limits: bool = True) -> List[str]:
         """
         嵌入图片到Excel文件中
         :param file_paths: 原始文件路径列表
         :param sheets_to_process_map: 包含需要处理的工作表索引的字典
         :param progress_callback: Optional callback to report progress
-        :return: None. Logs success/failure.
+        :param enforce_limits: 是否检查文件数量和总大小限制（监视目录服务模式下由队列限流代替）
+        :return: 扫描、读取或保存失败的文件路径列表（图片下载失败不计入）
         """
         start_time = time.time()
         logging.info("\n \n")
@@ -331,44 +918,49 @@ class ExcelImageEmbedder:
         if progress_callback:
             progress_callback("开始图片嵌入处理...")
 
-        if not self.check_file_count_and_size(file_paths):
+        if enforce_limits and not self.check_file_count_and_size(file_paths):
             logging.error("文件数量或大小不符合要求，终止处理。")
             if progress_callback:
                 progress_callback("文件数量或大小不符合要求，终止处理。")
-            return
+            return list(file_paths)
 
         total_files_processed = 0
         total_successful_files = 0
 
-        for file_path in file_paths:
+        stats = DownloadStats(self.max_run_bytes)
+        with self.tracer.span("plan_batch", "pipeline", files=len(file_paths)):
+            plan = self.plan_batch(file_paths, sheets_to_process_map, progress_callback)
+        failed_files = [file_path for file_path in file_paths
+                        if sheets_to_process_map.get(os.path.basename(file_path)) and file_path not in plan.file_hits]
+        download_results: Dict[str, Optional[str]] = {}
+        if plan.url_save_path_map:
+            if progress_callback:
+                progress_callback(f"开始下载图片：去重后共 {len(plan.url_save_path_map)} 个 URL")
+            with self.tracer.span("download_images", "pipeline", urls=len(plan.url_save_path_map)):
+                download_results = self._download_images(plan.ordered_url_save_path_map(), stats)
+
+        for file_path, hits in plan.file_hits.items():
             file_basename = os.path.basename(file_path)
-            sheets_to_process = sheets_to_process_map.get(file_basename, [])
-            if not sheets_to_process:
-                logging.info(f"文件 {file_basename} 没有选定的 sheet 进行处理，跳过。")
+            total_files_processed += 1
+            if not hits:
+                logging.info(f"文件 {file_basename} 无图片链接，跳过。")
                 if progress_callback:
-                    progress_callback(f"文件 {file_basename} 没有选定的 sheet 进行处理，跳过。")
+                    progress_callback(f"文件 {file_basename} 无图片链接，跳过。")
                 continue
 
-            total_files_processed += 1
             logging.info(f"-> 开始处理文件: {file_basename}")
             if progress_callback:
                 progress_callback(f"开始处理文件: {file_basename}")
-            self._successfully_downloaded_urls.clear()
 
             try:
-                wb = load_workbook(file_path)
-                url_save_path_map = self._collect_image_urls(wb, file_basename, sheets_to_process)
-                if not url_save_path_map:
-                    logging.info(f"文件 {file_basename} 无图片链接，跳过。")
-                    if progress_callback:
-                        progress_callback(f"文件 {file_basename} 无图片链接，跳过。")
-                    continue
-
-                download_results = self._download_images(url_save_path_map)
-                successful_embeds = self._embed_images_to_sheets(wb, file_basename, sheets_to_process, download_results)
+                with self.tracer.span("load_workbook", "workbook", file=file_basename, read_only=False):
+                    wb = load_workbook(file_path)
+                successful_embeds = self._embed_images_to_sheets(wb, file_basename, hits, download_results)
                 if successful_embeds > 0:
-                    self._save_output_file(wb, file_basename)
-                    total_successful_files += 1
+                    if self._save_output_file(wb, file_basename):
+                        total_successful_files += 1
+                    else:
+                        failed_files.append(file_path)
                 else:
                     logging.info(f"文件 {file_basename} 没有图片被处理或尝试嵌入，不生成新文件。")
                     if progress_callback:
@@ -376,15 +968,23 @@ class ExcelImageEmbedder:
 
             except FileNotFoundError:
                 logging.error(f"错误: 处理文件时 {file_path} 未找到。")
+                failed_files.append(file_path)
                 if progress_callback:
                     progress_callback(f"错误: 处理文件时 {file_path} 未找到。")
             except (OSError, InvalidFileException) as e:
                 logging.error(f"处理文件 {file_path} 时发生错误: {e}")
+                failed_files.append(file_path)
                 if progress_callback:
                     progress_callback(f"处理文件 {file_path} 时发生错误: {str(e)}")
 
         logging.info("-------------- 图片嵌入处理结束 --------------")
         logging.info(f"总共处理了 {total_files_processed} 个文件，成功生成 {total_successful_files} 个带图片的输出文件。")
+        logging.info(f"下载统计: {stats.summary()}")
+        latency_summary = stats.latency_summary()
+        if latency_summary:
+            logging.info(f"下载耗时: {latency_summary}")
+        self._negative_cache.save()
         logging.info(f"总处理耗时: {time.time() - start_time:.2f} 秒")
         if progress_callback:
             progress_callback(f"图片嵌入处理结束，总共处理了 {total_files_processed} 个文件，耗时: {time.time() - start_time:.2f} 秒")
+        return failed_files
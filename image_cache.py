@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import atexit
+import ctypes
+import socket
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Dict, Optional, Set, Tuple
+from PIL import Image as PILImage
+from PIL import UnidentifiedImageError
+
+# 图片缓存目录
+IMAGE_CACHE_DIR = "downloaded_images"
+
+# 支持的图片扩展名常量
+SUPPORTED_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.svg', '.webp')
+# 图片URL的匹配规则（对小写后的单元格值匹配）
+IMAGE_URL_REGEX = rf"^(https?://).*\.({'|'.join(ext[1:] for ext in SUPPORTED_IMAGE_EXTENSIONS)})$"
+
+# 条目锁参数：持有者每隔 LOCK_HEARTBEAT_SECONDS 刷新锁文件，超过 LOCK_STALE_SECONDS 未刷新视为持有者已退出
+LOCK_SUFFIX = '.lock'
+LOCK_HEARTBEAT_SECONDS = 10.0
+LOCK_STALE_SECONDS = 120.0
+LOCK_POLL_INTERVAL = 0.2
+TEMP_FILE_SUFFIX = '.part'
+# 持有者下载失败时留下的失败记录，供等待同一条目的其他进程读取
+FAILURE_SUFFIX = '.failed'
+
+# 本进程持有的条目锁文件，进程退出时统一释放（守护线程和被 terminate 的 QThread 不会走到 release）
+_held_lock_paths: Set[str] = set()
+_held_lock_paths_lock = threading.Lock()
+
+
+def release_process_locks() -> None:
+    """释放本进程持有的全部条目锁。在进程退出或下载线程被强制终止后调用。"""
+    with _held_lock_paths_lock:
+        lock_paths = list(_held_lock_paths)
+        _held_lock_paths.clear()
+    for lock_path in lock_paths:
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"释放缓存锁 {lock_path} 失败: {e}")
+
+
+atexit.register(release_process_locks)
+
+
+def _process_alive(pid: int) -> bool:
+    """本机上的进程是否仍在运行；无法确定时视为仍在运行。"""
+    if pid <= 0:
+        return False
+    if os.name == 'nt':
+        # Windows 上 os.kill 会终止目标进程，只能通过 OpenProcess 查询
+        process_query_limited_information = 0x1000
+        still_active = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(process_query_limited_information, False, pid)
+        if not handle:
+            # 拒绝访问说明进程存在
+            return ctypes.GetLastError() == 5
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return True
+            return exit_code.value == still_active
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class CacheEntryLock:
+    """
+    缓存条目锁：以 O_CREAT | O_EXCL 创建的 <缓存文件>.lock，对同机多进程和 NFS 共享目录均有效。
+    持有者在下载过程中调用 refresh() 维持心跳。
+    """
+
+    def __init__(self, lock_path: str, waited: bool = False):
+        """
+        :param lock_path: 锁文件路径
+        :param waited: 获取锁之前是否等待过其他持有者
+        """
+        self.lock_path = lock_path
+        self.waited = waited
+        self._last_refresh = time.monotonic()
+        with _held_lock_paths_lock:
+            _held_lock_paths.add(lock_path)
+
+    def refresh(self) -> None:
+        """刷新锁文件的修改时间，调用频率由 LOCK_HEARTBEAT_SECONDS 节流。"""
+        now = time.monotonic()
+        if now - self._last_refresh < LOCK_HEARTBEAT_SECONDS:
+            return
+        self._last_refresh = now
+        try:
+            os.utime(self.lock_path)
+        except OSError as e:
+            logging.warning(f"刷新缓存锁 {self.lock_path} 失败: {e}")
+
+    def release(self) -> None:
+        """释放锁。"""
+        with _held_lock_paths_lock:
+            _held_lock_paths.discard(self.lock_path)
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"释放缓存锁 {self.lock_path} 失败: {e}")
+
+
+class ImageCache:
+    """
+    本地图片缓存：URL 映射为 downloaded_images/<md5>.ext。
+    在内存中维护已校验条目的索引，长时间运行时同一 URL 只需校验一次磁盘文件。
+    多进程安全：写入先落到临时文件再原子重命名，读者只会看到完整文件；
+    每个条目通过 CacheEntryLock 保证同一时间只有一个进程/线程下载，其余等待其结果。
+    """
+
+    def __init__(self, cache_dir: str = IMAGE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._index: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, url: str) -> str:
+        """
+        计算 URL 对应的缓存文件路径
+        :param url: 图片URL
+        :return: 缓存文件路径
+        """
+        url_hash = hashlib.md5(url.encode('utf-8')).hexdigest()
+        ext = os.path.splitext(url.lower())[1]
+        if not ext or ext not in SUPPORTED_IMAGE_EXTENSIONS:
+            ext = '.jpg'
+        return os.path.join(self.cache_dir, f"{url_hash}{ext}")
+
+    def lookup(self, url: str, save_path: Optional[str] = None) -> Optional[str]:
+        """
+        查找已缓存且有效的图片
+        :param url: 图片URL
+        :param save_path: 缓存文件路径，默认按 URL 计算
+        :return: 有效的缓存文件路径，否则返回 None
+        """
+        save_path = save_path or self.path_for(url)
+        with self._lock:
+            indexed_path = self._index.get(url)
+        if indexed_path == save_path and os.path.exists(save_path):
+            return save_path
+
+        if not os.path.exists(save_path):
+            self.discard(url)
+            return None
+        try:
+            with PILImage.open(save_path) as img:
+                img.verify()
+        except (UnidentifiedImageError, OSError, SyntaxError):
+            # 不在此处删除：损坏的文件由持有条目锁的下载者原子地覆盖，避免与其他进程竞争
+            logging.warning(f"图片 {save_path} 存在但损坏，重新下载。")
+            self.discard(url)
+            return None
+        self.add(url, save_path)
+        return save_path
+
+    def acquire(self, url: str, save_path: str,
+                cancel_event: Optional[threading.Event] = None) -> Optional[CacheEntryLock]:
+        """
+        获取条目锁（single-flight）。若其他进程/线程正在下载同一 URL，则等待其完成
+        :param url: 图片URL
+        :param save_path: 缓存文件路径
+        :param cancel_event: 等待期间可被该事件打断
+        :return: 获得锁时返回 CacheEntryLock；等待期间条目已由他人写入或被取消时返回 None
+        """
+        lock_path = save_path + LOCK_SUFFIX
+        waited = False
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not waited:
+                    logging.debug(f"图片 {url} 正由其他进程下载，等待其结果。")
+                    waited = True
+                self._break_stale_lock(lock_path)
+                if cancel_event is not None:
+                    if cancel_event.wait(LOCK_POLL_INTERVAL):
+                        return None
+                else:
+                    time.sleep(LOCK_POLL_INTERVAL)
+                if os.path.exists(save_path) and not os.path.exists(lock_path) \
+                        and self.lookup(url, save_path):
+                    return None
+                continue
+            try:
+                os.write(fd, f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}".encode('utf-8'))
+            finally:
+                os.close(fd)
+            return CacheEntryLock(lock_path, waited)
+
+    @staticmethod
+    def _lock_owner_dead(lock_path: str) -> bool:
+        """锁文件记录的持有者（host:pid:tid）在本机且进程已退出时返回 True。"""
+        try:
+            with open(lock_path, 'r', encoding='utf-8') as file:
+                owner = file.read()
+        except OSError:
+            return False
+        parts = owner.rsplit(':', 2)
+        if len(parts) != 3 or parts[0] != socket.gethostname() or not parts[1].isdigit():
+            # 持有者刚创建锁尚未写入，或在其他主机上（NFS），只能按心跳判断
+            return False
+        return not _process_alive(int(parts[1]))
+
+    @classmethod
+    def _break_stale_lock(cls, lock_path: str) -> None:
+        """删除失效的锁文件：持有者进程已退出（本机）或长时间未刷新（其他主机）。"""
+        try:
+            if cls._lock_owner_dead(lock_path):
+                logging.warning(f"缓存锁 {lock_path} 的持有进程已退出，删除该锁。")
+                os.remove(lock_path)
+            elif time.time() - os.path.getmtime(lock_path) > LOCK_STALE_SECONDS:
+                logging.warning(f"缓存锁 {lock_path} 已超过 {LOCK_STALE_SECONDS:.0f} 秒未刷新，视为失效并删除。")
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"删除失效的缓存锁 {lock_path} 失败: {e}")
+
+    @staticmethod
+    def create_temp_file(save_path: str) -> Tuple[int, str]:
+        """
+        在缓存目录中创建临时文件，与最终文件同目录以保证重命名是原子的
+        :param save_path: 最终的缓存文件路径
+        :return: (文件描述符, 临时文件路径)
+        """
+        directory, filename = os.path.split(save_path)
+        return tempfile.mkstemp(prefix=f".{filename}.", suffix=TEMP_FILE_SUFFIX, dir=directory or '.')
+
+    def commit(self, url: str, temp_path: str, save_path: str) -> str:
+        """
+        将已校验的临时文件原子地重命名为缓存文件并登记索引
+        :param url: 图片URL
+        :param temp_path: 临时文件路径
+        :param save_path: 缓存文件路径
+        :return: 缓存文件路径
+        """
+        os.replace(temp_path, save_path)
+        self.add(url, save_path)
+        self._remove_failure(save_path)
+        return save_path
+
+    @staticmethod
+    def record_failure(save_path: str, failure: Dict) -> None:
+        """
+        持有条目锁的下载者失败时，留下失败记录供等待该条目的其他进程读取
+        :param save_path: 缓存文件路径
+        :param failure: 失效链接缓存中的记录，需包含 "expires"
+        """
+        failure_path = save_path + FAILURE_SUFFIX
+        directory, filename = os.path.split(failure_path)
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix=f".{filename}.", suffix=TEMP_FILE_SUFFIX, dir=directory or '.')
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(failure, file, ensure_ascii=False)
+            os.replace(temp_path, failure_path)
+        except OSError as e:
+            logging.warning(f"写入失败记录 {failure_path} 失败: {e}")
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @classmethod
+    def read_failure(cls, save_path: str) -> Optional[Dict]:
+        """
+        读取上一个持有者留下的失败记录
+        :param save_path: 缓存文件路径
+        :return: 未过期的失败记录，否则返回 None
+        """
+        try:
+            with open(save_path + FAILURE_SUFFIX, 'r', encoding='utf-8') as file:
+                failure = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取失败记录 {save_path + FAILURE_SUFFIX} 失败: {e}")
+            return None
+        if not isinstance(failure, dict) or failure.get("expires", 0) <= time.time():
+            cls._remove_failure(save_path)
+            return None
+        return failure
+
+    @staticmethod
+    def _remove_failure(save_path: str) -> None:
+        try:
+            os.remove(save_path + FAILURE_SUFFIX)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"删除失败记录 {save_path + FAILURE_SUFFIX} 失败: {e}")
+
+    def add(self, url: str, save_path: str) -> None:
+        """将已校验的图片登记到索引中。"""
+        with self._lock:
+            self._index[url] = save_path
+
+    def discard(self, url: str) -> None:
+        """从索引中移除 URL。"""
+        with self._lock:
+            self._index.pop(url, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index)
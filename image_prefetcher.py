@@ -0,0 +1,159 @@
+import os
+import time
+import heapq
+import logging
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+from bandwidth_limiter import BandwidthLimiter
+from download_stats import DownloadStats
+from excel_image_embedder import ExcelImageEmbedder
+
+# 预取默认参数
+PREFETCH_MAX_WORKERS = 2
+PREFETCH_BYTES_PER_SECOND = 2 * 1024 * 1024
+# 已被用户选中的 sheet 中的链接的权重，远高于未选中 sheet
+SELECTED_SHEET_WEIGHT = 10.0
+# 取消后等待预取线程退出的最长时间（秒）
+PREFETCH_CANCEL_TIMEOUT = 10.0
+# 预取使用较短的时限：正在进行的请求只能在超时后响应取消，且预取持有的条目锁会让正式下载等待
+PREFETCH_CONNECT_TIMEOUT = 3.0
+PREFETCH_READ_TIMEOUT = 3.0
+PREFETCH_TOTAL_TIMEOUT = 8.0
+
+
+class ImagePrefetcher:
+    """
+    推测式预取：在用户选择 sheet 期间，后台扫描已添加的文件并预热图片缓存。
+    按"可能被选中"的程度排序下载：已选中的 sheet 优先，其次是靠前的 sheet 和被多处引用的链接。
+    可随时取消，并通过 BandwidthLimiter 限制总带宽。
+    """
+
+    def __init__(self, file_paths: List[str], max_workers: int = PREFETCH_MAX_WORKERS,
+                 bytes_per_second: int = PREFETCH_BYTES_PER_SECOND, download_options: Optional[Dict] = None):
+        """
+        :param file_paths: 需要预取的文件路径列表
+        :param max_workers: 预取下载线程数
+        :param bytes_per_second: 预取总带宽上限
+        :param download_options: 传给 ExcelImageEmbedder 的下载参数
+        """
+        self.file_paths = list(file_paths)
+        self.max_workers = max(1, max_workers)
+        self._cancel_event = threading.Event()
+        embedder_kwargs = {"connect_timeout": PREFETCH_CONNECT_TIMEOUT, "read_timeout": PREFETCH_READ_TIMEOUT,
+                           "total_timeout": PREFETCH_TOTAL_TIMEOUT}
+        embedder_kwargs.update(download_options or {})
+        self._embedder = ExcelImageEmbedder(max_workers=self.max_workers,
+                                            rate_limiter=BandwidthLimiter(bytes_per_second),
+                                            cancel_event=self._cancel_event, **embedder_kwargs)
+        self._stats = DownloadStats(self._embedder.max_run_bytes)
+        # URL -> 引用它的 (file_path, sheet_index)
+        self._url_refs: Dict[str, Set[Tuple[str, int]]] = {}
+        self._url_save_paths: Dict[str, str] = {}
+        self._selection: Dict[str, Set[int]] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._heap_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._prefetched = 0
+
+    def start(self) -> None:
+        """在后台线程中开始扫描和预取。"""
+        thread = threading.Thread(target=self._run, name="image-prefetch", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def cancel(self) -> None:
+        """请求取消预取。扫描在下一个文件或 sheet 处停止，下载在下一个数据块或下一次请求前中止。"""
+        self._cancel_event.set()
+
+    def join(self, timeout: Optional[float] = PREFETCH_CANCEL_TIMEOUT) -> bool:
+        """
+        等待预取线程退出
+        :param timeout: 所有线程共用的最长等待时间（秒），None 表示一直等待
+        :return: 所有线程都已退出返回 True
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in list(self._threads):
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def update_selection(self, file_sheet_map: Dict) -> None:
+        """
+        根据用户当前的选择调整剩余链接的优先级
+        :param file_sheet_map: 文件路径到 {"file_name", "sheet_indices"} 的字典
+        """
+        with self._heap_lock:
+            self._selection = {file_path: set(info.get("sheet_indices", []))
+                               for file_path, info in file_sheet_map.items()}
+            self._rebuild_heap()
+
+    def _score(self, url: str) -> float:
+        """链接被选中的可能性评分，越高越优先。"""
+        score = 0.0
+        for file_path, sheet_index in self._url_refs.get(url, ()):
+            if sheet_index in self._selection.get(file_path, ()):
+                score += SELECTED_SHEET_WEIGHT
+            else:
+                score += 1.0 / (1 + sheet_index)
+        return score
+
+    def _rebuild_heap(self) -> None:
+        """按当前评分重建剩余链接的优先队列，调用方需持有 _heap_lock。"""
+        pending = [url for _, _, url in self._heap]
+        order = {url: i for i, url in enumerate(self._url_save_paths)}
+        self._heap = [(-self._score(url), order[url], url) for url in pending]
+        heapq.heapify(self._heap)
+
+    def _next_url(self) -> Optional[str]:
+        with self._heap_lock:
+            if not self._heap:
+                return None
+            return heapq.heappop(self._heap)[2]
+
+    def _run(self) -> None:
+        try:
+            sheets_map = {os.path.basename(file_path): [sheet_index for sheet_index, _ in sheets]
+                          for file_path, sheets in self._sheet_info().items()}
+            if self.is_cancelled():
+                return
+            plan = self._embedder.plan_batch(self.file_paths, sheets_map)
+            if self.is_cancelled() or not plan.url_save_path_map:
+                return
+
+            with self._heap_lock:
+                for file_path, hits in plan.file_hits.items():
+                    for sheet_index, _, _, url in hits:
+                        self._url_refs.setdefault(url, set()).add((file_path, sheet_index))
+                self._url_save_paths = dict(plan.url_save_path_map)
+                self._heap = [(0.0, 0, url) for url in self._url_save_paths]
+                self._rebuild_heap()
+            logging.info(f"--- 开始预取图片 ({len(self._url_save_paths)} 个 URL) ---")
+
+            workers = [threading.Thread(target=self._download_loop, name=f"image-prefetch-{i}", daemon=True)
+                       for i in range(self.max_workers)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            status = "已取消" if self.is_cancelled() else "完成"
+            logging.info(f"--- 图片预取{status}：预热 {self._prefetched} 张，{self._stats.summary()} ---")
+        except Exception as e:
+            logging.error(f"图片预取失败: {e}", exc_info=True)
+        finally:
+            self._embedder.close()
+
+    def _sheet_info(self) -> Dict[str, List[Tuple[int, str]]]:
+        """读取每个文件的 sheet 列表，键为完整路径。"""
+        info = ExcelImageEmbedder.get_file_and_sheet_info(self.file_paths)
+        return {file_path: info.get(os.path.basename(file_path), []) for file_path in self.file_paths}
+
+    def _download_loop(self) -> None:
+        while not self.is_cancelled():
+            url = self._next_url()
+            if url is None:
+                return
+            if self._embedder.download_image(url, self._url_save_paths[url], self._stats):
+                with self._heap_lock:
+                    self._prefetched += 1
@@ -0,0 +1,58 @@
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence
+
+# 每个主机保留的最近样本数
+LATENCY_WINDOW_SIZE = 200
+# 样本数达到此值后才计算分位数，避免冷启动时用少量样本驱动对冲
+LATENCY_MIN_SAMPLES = 20
+
+
+def percentile(values: Sequence[float], p: float) -> Optional[float]:
+    """
+    计算分位数（最近秩法）
+    :param values: 样本
+    :param p: 分位，0-100
+    :return: 分位数，样本为空时返回 None
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class LatencyTracker:
+    """按主机记录最近的下载耗时，供对冲请求判断“慢于 p95”。线程安全。"""
+
+    def __init__(self, window_size: int = LATENCY_WINDOW_SIZE, min_samples: int = LATENCY_MIN_SAMPLES):
+        """
+        :param window_size: 每个主机保留的最近样本数
+        :param min_samples: 计算分位数所需的最少样本数
+        """
+        self.window_size = window_size
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, host: str, seconds: float) -> None:
+        """记录一次成功下载的耗时。"""
+        with self._lock:
+            samples = self._samples.get(host)
+            if samples is None:
+                samples = self._samples[host] = deque(maxlen=self.window_size)
+            samples.append(seconds)
+
+    def percentile(self, host: str, p: float) -> Optional[float]:
+        """
+        主机最近耗时的分位数
+        :param host: 主机名
+        :param p: 分位，0-100
+        :return: 样本不足时返回 None
+        """
+        with self._lock:
+            samples: List[float] = list(self._samples.get(host, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return percentile(samples, p)
@@ -2,11 +2,14 @@ import sys
 import platform
 import logging
 import argparse
+from typing import Dict
 from PyQt6.QtWidgets import QApplication
 from PyQt6.QtCore import Qt
 
 import custom_log_config
 from excel_file_selector import ExcelFileSelector
+from excel_image_embedder import MAX_IMAGE_BYTES, DOWNLOAD_CHUNK_SIZE
+from watch_folder_service import WatchFolderService, WATCH_QUEUE_SIZE, WATCH_WORKER_COUNT
 
 # 应用程序元数据
 APP_NAME = "Excel Image Embedder"
@@ -33,12 +36,94 @@ def parse_arguments() -> argparse.Namespace:
             action='store_true',
             help='启用调试日志'
         )
+        parser.add_argument(
+            '--trace',
+            metavar='FILE',
+            help='记录下载/嵌入流水线时间线并导出为 Chrome trace JSON（可在 Perfetto 中打开）'
+        )
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='忽略失效链接缓存，强制重试近期下载失败的图片链接'
+        )
+        parser.add_argument(
+            '--hedge',
+            action='store_true',
+            help='对慢于主机 p95 耗时的下载发起对冲请求，取先完成的结果'
+        )
+        parser.add_argument(
+            '--max-image-mb',
+            type=float,
+            default=MAX_IMAGE_BYTES / (1024 * 1024),
+            help=f'单张图片允许下载的最大 MB 数，0 表示不限制（默认 {MAX_IMAGE_BYTES // (1024 * 1024)}）'
+        )
+        parser.add_argument(
+            '--chunk-kb',
+            type=int,
+            default=DOWNLOAD_CHUNK_SIZE // 1024,
+            help=f'流式读取响应体的块大小 KB（默认 {DOWNLOAD_CHUNK_SIZE // 1024}）'
+        )
+        parser.add_argument(
+            '--head-precheck',
+            action='store_true',
+            help='下载前先发送 HEAD 请求，按 Content-Type / Content-Length 提前跳过不符合要求的链接'
+        )
+        parser.add_argument(
+            '--no-prefetch',
+            action='store_true',
+            help='禁用选择 sheet 期间的后台图片预取'
+        )
+        parser.add_argument(
+            '--watch',
+            metavar='DIR',
+            help='以监视目录服务模式运行（不启动 GUI），处理 DIR 中新出现的工作簿'
+        )
+        parser.add_argument(
+            '--watch-workers',
+            type=int,
+            default=WATCH_WORKER_COUNT,
+            help=f'服务模式下处理工作簿的线程数（默认 {WATCH_WORKER_COUNT}）'
+        )
+        parser.add_argument(
+            '--queue-size',
+            type=int,
+            default=WATCH_QUEUE_SIZE,
+            help=f'服务模式下待处理队列的最大长度（默认 {WATCH_QUEUE_SIZE}）'
+        )
         return parser.parse_args()
     except Exception as e:
         logging.error(f"解析命令行参数失败: {e}")
         raise
 
 
+def build_download_options(args: argparse.Namespace) -> Dict:
+    """根据命令行参数生成传给 ExcelImageEmbedder 的下载参数。"""
+    return {
+        "max_image_bytes": int(args.max_image_mb * 1024 * 1024) if args.max_image_mb > 0 else None,
+        "chunk_size": max(1, args.chunk_kb) * 1024,
+        "head_precheck": args.head_precheck,
+    }
+
+
+def run_watch_service(args: argparse.Namespace) -> int:
+    """以监视目录服务模式运行，直到收到中断信号。"""
+    try:
+        service = WatchFolderService(
+            args.watch,
+            queue_size=args.queue_size,
+            worker_count=args.watch_workers,
+            trace_path=args.trace,
+            retry_failed=args.retry_failed,
+            hedge_requests=args.hedge,
+            download_options=build_download_options(args)
+        )
+        service.run_forever()
+        return 0
+    except OSError as e:
+        logging.error(f"监视目录服务运行失败: {e}")
+        return 4
+
+
 def main() -> int:
     """
     Excel Image Embedder 应用程序的主入口点。
@@ -54,6 +139,9 @@ def main() -> int:
     # 设置基本控制台日志记录以捕获早期错误
     setup_basic_logging(verbose=args.verbose)
 
+    if args.watch:
+        return run_watch_service(args)
+
     try:
         # 使用系统参数初始化 QApplication
         app = QApplication(sys.argv)
@@ -68,7 +156,9 @@ def main() -> int:
         app.setQuitOnLastWindowClosed(True)
 
         # 创建并显示主窗口
-        main_window = ExcelFileSelector()
+        main_window = ExcelFileSelector(trace_path=args.trace, prefetch=not args.no_prefetch,
+                                        retry_failed=args.retry_failed, hedge_requests=args.hedge,
+                                        download_options=build_download_options(args))
         main_window.show()
         logging.info(f"{APP_NAME} v{APP_VERSION} 已启动。")
 
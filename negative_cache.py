@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from typing import Dict, Optional
+
+# 失败类别
+FAILURE_HTTP_NOT_FOUND = "http_404"
+FAILURE_HTTP_CLIENT = "http_4xx"
+FAILURE_HTTP_SERVER = "http_5xx"
+FAILURE_HTTP_TRANSIENT = "http_transient"
+FAILURE_DNS = "dns"
+FAILURE_CONNECT = "connect"
+FAILURE_TIMEOUT = "timeout"
+FAILURE_INVALID_IMAGE = "invalid_image"
+FAILURE_TOO_LARGE = "too_large"
+
+# 各类失败的过期时间（秒）：确定性的失败保留更久，瞬时故障很快过期
+FAILURE_TTL_SECONDS: Dict[str, float] = {
+    FAILURE_HTTP_NOT_FOUND: 7 * 24 * 3600,
+    FAILURE_HTTP_CLIENT: 24 * 3600,
+    FAILURE_HTTP_SERVER: 10 * 60,
+    FAILURE_HTTP_TRANSIENT: 5 * 60,
+    FAILURE_DNS: 3600,
+    FAILURE_CONNECT: 15 * 60,
+    FAILURE_TIMEOUT: 30 * 60,
+    FAILURE_INVALID_IMAGE: 24 * 3600,
+    FAILURE_TOO_LARGE: 24 * 3600,
+}
+
+NEGATIVE_CACHE_FILENAME = "negative_cache.json"
+
+
+class NegativeCache:
+    """
+    失效链接的持久化缓存：按失败类别记录 URL，并按类别过期。
+    保存时与磁盘上的内容合并后原子替换，多个进程可共享同一个文件。
+    """
+
+    def __init__(self, path: str, ttl_seconds: Optional[Dict[str, float]] = None):
+        """
+        :param path: 缓存文件路径
+        :param ttl_seconds: 各失败类别的过期时间，默认 FAILURE_TTL_SECONDS
+        """
+        self.path = path
+        self.ttl_seconds = dict(FAILURE_TTL_SECONDS)
+        if ttl_seconds:
+            self.ttl_seconds.update(ttl_seconds)
+        self._removed: set = set()
+        # 自上次保存以来本进程记录的 URL，保存时只写回这些条目，避免用过期的内存副本覆盖其他进程的修改
+        self._updated: set = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = self._read_file()
+
+    def _read_file(self) -> Dict[str, Dict]:
+        """读取磁盘上未过期的条目。"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取失效链接缓存 {self.path} 失败，忽略: {e}")
+            return {}
+        now = time.time()
+        return {url: entry for url, entry in data.items()
+                if isinstance(entry, dict) and entry.get("expires", 0) > now}
+
+    def get(self, url: str) -> Optional[Dict]:
+        """
+        查询 URL 的失败记录
+        :param url: 图片URL
+        :return: 未过期的记录 {"class", "time", "expires", "detail"}，否则返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            if entry["expires"] <= time.time():
+                del self._entries[url]
+                return None
+            return entry
+
+    def record(self, url: str, failure_class: str, detail: str = "") -> None:
+        """
+        记录一次失败
+        :param url: 图片URL
+        :param failure_class: 失败类别，例如 FAILURE_HTTP_NOT_FOUND
+        :param detail: 失败详情
+        """
+        ttl = self.ttl_seconds.get(failure_class)
+        if not ttl:
+            return
+        now = time.time()
+        with self._lock:
+            self._entries[url] = {"class": failure_class, "time": now, "expires": now + ttl, "detail": detail[:200]}
+            self._removed.discard(url)
+            self._updated.add(url)
+            self._dirty = True
+
+    def discard(self, url: str) -> None:
+        """URL 下载成功后移除其失败记录。"""
+        with self._lock:
+            if self._entries.pop(url, None) is not None:
+                self._removed.add(url)
+                self._updated.discard(url)
+                self._dirty = True
+
+    def clear(self) -> None:
+        """清空所有失败记录（强制重试全部失效链接）。"""
+        with self._lock:
+            self._removed.update(self._entries)
+            self._entries.clear()
+            self._updated.clear()
+            self._dirty = True
+
+    def save(self) -> None:
+        """与磁盘上的记录合并后原子写回。"""
+        with self._lock:
+            if not self._dirty:
+                return
+            merged = self._read_file()
+            for url in self._removed:
+                merged.pop(url, None)
+            for url in self._updated:
+                entry = self._entries.get(url)
+                if entry and (url not in merged or merged[url].get("time", 0) <= entry["time"]):
+                    merged[url] = entry
+            temp_path = None
+            try:
+                directory = os.path.dirname(self.path) or '.'
+                os.makedirs(directory, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(prefix=".negative_cache.", suffix=".part", dir=directory)
+                with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                    json.dump(merged, file, ensure_ascii=False)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logging.error(f"保存失效链接缓存 {self.path} 失败: {e}")
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return
+            self._entries = merged
+            self._removed.clear()
+            self._updated.clear()
+            self._dirty = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
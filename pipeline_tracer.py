@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+# 单个 tracer 最多保留的事件数，防止服务模式下无限增长
+MAX_TRACE_EVENTS = 500000
+
+
+class PipelineTracer:
+    """
+    下载/嵌入流水线的时间线记录器。
+    记录带线程 ID 的耗时区间，导出为 Chrome trace / Perfetto 可直接打开的 JSON。
+    enabled=False 时所有记录操作均为空操作。
+    """
+
+    def __init__(self, enabled: bool = True, max_events: int = MAX_TRACE_EVENTS):
+        """
+        :param enabled: 是否记录
+        :param max_events: 最多保留的事件数
+        """
+        self.enabled = enabled
+        self.max_events = max_events
+        self._origin = time.perf_counter()
+        self._events: List[Dict] = []
+        self._thread_names: Dict[int, str] = {}
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, category: str = "pipeline", **args):
+        """
+        记录一个耗时区间，yield 参数字典，可在区间内补充参数（例如结果）
+        :param name: 区间名称
+        :param category: 分类，例如 download / workbook / embed
+        :param args: 附加到事件上的参数
+        """
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add_span(name, start, time.perf_counter(), category, **args)
+
+    def add_span(self, name: str, start: float, end: float, category: str = "pipeline", **args) -> None:
+        """
+        记录一个已知起止时间的区间
+        :param name: 区间名称
+        :param start: 开始时间（perf_counter 秒）
+        :param end: 结束时间（perf_counter 秒）
+        :param category: 分类
+        :param args: 附加参数
+        """
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - self._origin) * 1e6, 3),
+            "dur": round(max(0.0, end - start) * 1e6, 3),
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self._lock:
+            if len(self._events) >= self.max_events:
+                self._dropped += 1
+                return
+            self._events.append(event)
+            self._thread_names.setdefault(thread.ident, thread.name)
+
+    def export(self, path: str) -> bool:
+        """
+        导出为 Chrome trace JSON
+        :param path: 输出文件路径
+        :return: 成功返回 True
+        """
+        if not self.enabled:
+            return False
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+            dropped = self._dropped
+        metadata = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                    for tid, name in thread_names.items()]
+        try:
+            output_dir = os.path.dirname(path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, file, ensure_ascii=False)
+        except OSError as e:
+            logging.error(f"导出时间线文件 {path} 失败: {e}")
+            return False
+        if dropped:
+            logging.warning(f"时间线事件超过上限 {self.max_events}，丢弃了 {dropped} 个事件。")
+        logging.info(f"已导出时间线 ({len(events)} 个事件) 到 {path}，可在 chrome://tracing 或 Perfetto 中打开。")
+        return True
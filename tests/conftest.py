@@ -0,0 +1,71 @@
+import io
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image as PILImage
+
+# 模块位于仓库根目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _png_bytes() -> bytes:
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (2, 2), 'red').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class _ImageServer:
+    """本地测试服务器：/hang/* 不返回响应，/slow/* 延迟后返回图片，其余路径直接返回图片。记录每个路径收到的 GET 次数。"""
+
+    def __init__(self):
+        self.requests = {}
+        self.slow_delay = 0.0
+        self.released = threading.Event()
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests[self.path] = server.requests.get(self.path, 0) + 1
+                if self.path.startswith('/hang/'):
+                    server.released.wait(30)
+                    return
+                if self.path.startswith('/slow/'):
+                    server.released.wait(server.slow_delay)
+                body = _png_bytes()
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}{path}"
+
+    def count(self, path: str) -> int:
+        with self._lock:
+            return self.requests.get(path, 0)
+
+    def close(self):
+        self.released.set()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    image_server = _ImageServer()
+    yield image_server
+    image_server.close()
@@ -0,0 +1,123 @@
+import os
+import time
+import threading
+
+from image_cache import ImageCache
+from download_stats import DownloadStats
+from negative_cache import NegativeCache
+from excel_image_embedder import ExcelImageEmbedder
+
+
+def _embedder(tmp_path, cache_dir=None, name="negative_cache.json", **kwargs) -> ExcelImageEmbedder:
+    cache_dir = cache_dir or str(tmp_path / "cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return ExcelImageEmbedder(image_cache=ImageCache(cache_dir),
+                              negative_cache=NegativeCache(str(tmp_path / name)), **kwargs)
+
+
+def _download_concurrently(jobs):
+    """并发执行 [(embedder, url), ...]，返回各自的结果。"""
+    results = [None] * len(jobs)
+
+    def run(index, embedder, url):
+        results[index] = embedder.download_image(url)
+
+    threads = [threading.Thread(target=run, args=(i, embedder, url)) for i, (embedder, url) in enumerate(jobs)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.1)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_waiter_reuses_holder_failure_in_process(tmp_path, server):
+    embedder = _embedder(tmp_path, read_timeout=1, total_timeout=2)
+    url = server.url('/hang/a.png')
+    start = time.monotonic()
+    results = _download_concurrently([(embedder, url), (embedder, url)])
+    elapsed = time.monotonic() - start
+    embedder.close()
+
+    assert results == [None, None]
+    assert server.count('/hang/a.png') == 2
+    assert elapsed < 3.5
+
+
+def test_waiter_reuses_holder_failure_across_processes(tmp_path, server):
+    # 两个嵌入器各自持有失效链接缓存，只共享缓存目录，相当于两个进程
+    cache_dir = str(tmp_path / "cache")
+    holder = _embedder(tmp_path, cache_dir, "holder.json", read_timeout=1, total_timeout=2)
+    waiter = _embedder(tmp_path, cache_dir, "waiter.json", read_timeout=1, total_timeout=2)
+    url = server.url('/hang/b.png')
+    results = _download_concurrently([(holder, url), (waiter, url)])
+    holder.close()
+    waiter.close()
+
+    assert results == [None, None]
+    assert server.count('/hang/b.png') == 2
+
+
+def test_successful_download_is_shared_with_waiter(tmp_path, server):
+    server.slow_delay = 0.5
+    embedder = _embedder(tmp_path)
+    url = server.url('/slow/c.png')
+    results = _download_concurrently([(embedder, url), (embedder, url)])
+    embedder.close()
+
+    assert results[0] is not None and results[0] == results[1]
+    assert server.count('/slow/c.png') == 1
+
+
+def test_cancel_stops_retries_of_hanging_request(tmp_path, server):
+    cancel_event = threading.Event()
+    embedder = _embedder(tmp_path, read_timeout=1, total_timeout=10, cancel_event=cancel_event)
+    threading.Timer(0.5, cancel_event.set).start()
+    start = time.monotonic()
+    assert embedder.download_image(server.url('/hang/d.png')) is None
+    elapsed = time.monotonic() - start
+    embedder.close()
+
+    # 正在进行的请求只能在读取超时后返回，之后不能再发起重试
+    assert server.count('/hang/d.png') == 1
+    assert elapsed < 2.0
+
+
+def test_total_deadline_bounds_retries(tmp_path, server):
+    embedder = _embedder(tmp_path, read_timeout=1, total_timeout=2)
+    start = time.monotonic()
+    assert embedder.download_image(server.url('/hang/e.png')) is None
+    elapsed = time.monotonic() - start
+    embedder.close()
+
+    assert elapsed < 3.0
+    assert server.count('/hang/e.png') <= 2
+
+
+def test_hedge_wins_over_slow_primary(tmp_path, server):
+    embedder = _embedder(tmp_path, hedge_requests=True, read_timeout=1, total_timeout=3)
+    host = '127.0.0.1'
+    for _ in range(embedder._latency_tracker.min_samples):
+        embedder._latency_tracker.record(host, 0.05)
+    stats = DownloadStats()
+
+    # 首个请求落到挂起的路径；对冲请求发出前改写会话，使第二个请求落到正常路径
+    original_get = embedder._session.get
+    calls = []
+
+    def get(url, **kwargs):
+        calls.append(url)
+        if len(calls) > 1:
+            url = url.replace('/hang/', '/ok/')
+        return original_get(url, **kwargs)
+
+    embedder._session.get = get
+    start = time.monotonic()
+    result = embedder.download_image(server.url('/hang/f.png'), stats=stats)
+    elapsed = time.monotonic() - start
+    embedder.close()
+
+    assert result is not None and os.path.exists(result)
+    assert stats.hedged_count == 1 and stats.hedge_wins == 1
+    assert elapsed < 1.0
+    assert not [name for name in os.listdir(tmp_path / "cache") if name.endswith('.part')]
@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+import socket
+import threading
+import subprocess
+
+from image_cache import ImageCache, LOCK_SUFFIX, LOCK_STALE_SECONDS
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_orphaned_lock_of_exited_process_is_broken_immediately(tmp_path):
+    cache = ImageCache(str(tmp_path))
+    url = "https://example.com/a.png"
+    save_path = cache.path_for(url)
+    # 子进程获取条目锁后直接退出（os._exit 跳过 atexit），模拟被终止的下载进程
+    script = ("import os, sys; sys.path.insert(0, sys.argv[1]); from image_cache import ImageCache; "
+              "cache = ImageCache(sys.argv[2]); url = sys.argv[3]; "
+              "assert cache.acquire(url, cache.path_for(url)) is not None; os._exit(0)")
+    subprocess.run([sys.executable, "-c", script, REPO_DIR, str(tmp_path), url], check=True)
+    assert os.path.exists(save_path + LOCK_SUFFIX)
+
+    start = time.monotonic()
+    entry_lock = cache.acquire(url, save_path)
+    assert entry_lock is not None
+    assert time.monotonic() - start < LOCK_STALE_SECONDS / 10
+    entry_lock.release()
+    assert not os.path.exists(save_path + LOCK_SUFFIX)
+
+
+def test_lock_of_live_process_is_respected(tmp_path):
+    cache = ImageCache(str(tmp_path))
+    url = "https://example.com/b.png"
+    save_path = cache.path_for(url)
+    with open(save_path + LOCK_SUFFIX, 'w', encoding='utf-8') as file:
+        file.write(f"{socket.gethostname()}:{os.getpid()}:1")
+
+    cancel_event = threading.Event()
+    threading.Timer(0.5, cancel_event.set).start()
+    assert cache.acquire(url, save_path, cancel_event) is None
+    assert os.path.exists(save_path + LOCK_SUFFIX)
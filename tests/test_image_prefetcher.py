@@ -0,0 +1,28 @@
+import time
+
+from openpyxl import Workbook
+
+from image_prefetcher import ImagePrefetcher, PREFETCH_READ_TIMEOUT
+
+
+def test_cancel_stops_prefetch_of_hanging_urls(tmp_path, monkeypatch, server):
+    monkeypatch.chdir(tmp_path)
+    workbook_path = str(tmp_path / "book.xlsx")
+    wb = Workbook()
+    for i in range(4):
+        wb.active.append([server.url(f'/hang/{i}.png')])
+    wb.save(workbook_path)
+
+    prefetcher = ImagePrefetcher([workbook_path], max_workers=2)
+    prefetcher.start()
+    deadline = time.monotonic() + 10
+    while sum(server.requests.values()) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert sum(server.requests.values()) == 2
+
+    start = time.monotonic()
+    prefetcher.cancel()
+    assert prefetcher.join()
+    assert time.monotonic() - start < PREFETCH_READ_TIMEOUT + 1
+    # 取消后不再重试，也不再请求剩余的链接
+    assert len(server.requests) == 2 and set(server.requests.values()) == {1}
@@ -0,0 +1,37 @@
+import json
+
+from negative_cache import NegativeCache, FAILURE_HTTP_NOT_FOUND, FAILURE_TIMEOUT
+
+
+def test_save_merges_with_entries_written_by_other_processes(tmp_path):
+    path = str(tmp_path / "negative_cache.json")
+    first = NegativeCache(path)
+    first.record("https://example.com/a.png", FAILURE_HTTP_NOT_FOUND)
+    first.record("https://example.com/b.png", FAILURE_TIMEOUT)
+    first.save()
+
+    # 第二个进程读到 a、b 后成功下载了 b，同时第一个进程又记录了 d
+    second = NegativeCache(path)
+    first.record("https://example.com/d.png", FAILURE_TIMEOUT)
+    second.record("https://example.com/c.png", FAILURE_TIMEOUT)
+    second.discard("https://example.com/b.png")
+    second.save()
+    first.save()
+
+    with open(path, encoding='utf-8') as file:
+        assert set(json.load(file)) == {"https://example.com/a.png", "https://example.com/c.png",
+                                        "https://example.com/d.png"}
+    assert first.get("https://example.com/b.png") is None
+
+
+def test_clear_removes_entries_on_save(tmp_path):
+    path = str(tmp_path / "negative_cache.json")
+    cache = NegativeCache(path)
+    cache.record("https://example.com/a.png", FAILURE_HTTP_NOT_FOUND)
+    cache.save()
+
+    reloaded = NegativeCache(path)
+    assert reloaded.get("https://example.com/a.png")["class"] == FAILURE_HTTP_NOT_FOUND
+    reloaded.clear()
+    reloaded.save()
+    assert len(NegativeCache(path)) == 0
@@ -0,0 +1,212 @@
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+from excel_image_embedder import ExcelImageEmbedder, OUTPUT_DIR
+from pipeline_tracer import PipelineTracer
+
+# 服务模式默认参数
+WATCH_POLL_INTERVAL = 2.0
+WATCH_QUEUE_SIZE = 20
+WATCH_WORKER_COUNT = 2
+WATCH_FILE_EXTENSIONS = ('.xlsx', '.xlsm')
+# 处理失败的文件按指数退避重试，超过次数后等到文件再次修改才重试
+WATCH_RETRY_DELAY = 10.0
+WATCH_MAX_RETRIES = 5
+
+
+class WatchFolderService:
+    """
+    监视目录服务：轮询输入目录，将新出现的工作簿放入有界队列，
+    由若干工作线程使用同一个 ExcelImageEmbedder（共享 Session、缓存索引和下载线程池）处理。
+    队列满时暂停入队，文件留待下一轮轮询，以此代替 MAX_FILE_COUNT / MAX_TOTAL_SIZE 的硬性限制。
+    """
+
+    def __init__(self, input_dir: str, queue_size: int = WATCH_QUEUE_SIZE,
+                 worker_count: int = WATCH_WORKER_COUNT, poll_interval: float = WATCH_POLL_INTERVAL,
+                 embedder: Optional[ExcelImageEmbedder] = None, trace_path: Optional[str] = None,
+                 retry_failed: bool = False, hedge_requests: bool = False,
+                 download_options: Optional[Dict] = None):
+        """
+        :param input_dir: 监视的输入目录
+        :param queue_size: 待处理队列的最大长度
+        :param worker_count: 处理工作簿的线程数
+        :param poll_interval: 轮询间隔（秒）
+        :param embedder: 共享的嵌入器，默认新建
+        :param trace_path: 时间线导出路径，服务停止时写出；为 None 时不记录
+        :param retry_failed: 是否忽略失效链接缓存，强制重试已知失败的链接
+        :param hedge_requests: 是否对慢请求发起对冲请求（服务模式下主机耗时样本在多次处理间累积）
+        :param download_options: 传给 ExcelImageEmbedder 的下载参数（max_image_bytes、chunk_size、head_precheck 等）
+        """
+        self.input_dir = input_dir
+        self.poll_interval = max(0.1, poll_interval)
+        self.worker_count = max(1, worker_count)
+        self._queue: "queue.Queue[Tuple[str, Tuple[float, int]]]" = queue.Queue(maxsize=max(1, queue_size))
+        self.trace_path = trace_path
+        self._tracer = PipelineTracer() if trace_path else None
+        self._embedder = embedder or ExcelImageEmbedder(tracer=self._tracer, retry_failed=retry_failed,
+                                                        hedge_requests=hedge_requests, **(download_options or {}))
+        self._stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+        # 上一轮轮询看到的 (mtime, size)，两轮一致才认为文件已写完
+        self._pending: Dict[str, Tuple[float, int]] = {}
+        # 已成功处理的文件及其 (mtime, size)
+        self._seen: Dict[str, Tuple[float, int]] = {}
+        # 已入队或正在处理的文件
+        self._in_flight: Set[str] = set()
+        # 处理失败的文件 -> (签名, 失败次数, 下次重试时间)
+        self._failures: Dict[str, Tuple[Tuple[float, int], int, float]] = {}
+        self._seen_lock = threading.Lock()
+        self._backpressure = False
+
+    def start(self) -> None:
+        """启动轮询线程和工作线程。"""
+        if self._threads:
+            return
+        os.makedirs(self.input_dir, exist_ok=True)
+        self._stop_event.clear()
+        for i in range(self.worker_count):
+            thread = threading.Thread(target=self._worker_loop, name=f"watch-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        poller = threading.Thread(target=self._poll_loop, name="watch-poller", daemon=True)
+        poller.start()
+        self._threads.append(poller)
+        logging.info(f"监视目录服务已启动: {os.path.abspath(self.input_dir)}，"
+                     f"工作线程 {self.worker_count} 个，队列上限 {self._queue.maxsize}")
+
+    def stop(self) -> None:
+        """停止服务，等待正在处理的工作簿完成。"""
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        self._embedder.close()
+        if self._tracer:
+            self._tracer.export(self.trace_path)
+        logging.info("监视目录服务已停止。")
+
+    def run_forever(self) -> None:
+        """启动服务并阻塞，直到收到 KeyboardInterrupt。"""
+        self.start()
+        try:
+            while not self._stop_event.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            logging.info("收到中断信号，正在停止监视目录服务...")
+        finally:
+            self.stop()
+
+    def _poll_loop(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self._poll_once()
+            except OSError as e:
+                logging.error(f"扫描监视目录 {self.input_dir} 失败: {e}")
+            self._stop_event.wait(self.poll_interval)
+
+    def _poll_once(self) -> None:
+        """扫描输入目录一次，将已写完且未处理的工作簿入队。"""
+        current: Dict[str, Tuple[float, int]] = {}
+        with os.scandir(self.input_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if (not entry.is_file() or name.startswith('~$')
+                        or not name.lower().endswith(WATCH_FILE_EXTENSIONS)):
+                    continue
+                stat = entry.stat()
+                current[entry.path] = (stat.st_mtime, stat.st_size)
+
+        now = time.monotonic()
+        for file_path, signature in sorted(current.items(), key=lambda item: item[1][0]):
+            with self._seen_lock:
+                if self._seen.get(file_path) == signature or file_path in self._in_flight:
+                    continue
+                failure = self._failures.get(file_path)
+                if failure and failure[0] == signature and now < failure[2]:
+                    continue
+            if self._pending.get(file_path) != signature:
+                # 文件可能仍在写入，等下一轮确认大小和修改时间不再变化
+                continue
+            if self._is_output_up_to_date(file_path, signature[0]):
+                with self._seen_lock:
+                    self._seen[file_path] = signature
+                continue
+            with self._seen_lock:
+                self._in_flight.add(file_path)
+            try:
+                self._queue.put_nowait((file_path, signature))
+            except queue.Full:
+                with self._seen_lock:
+                    self._in_flight.discard(file_path)
+                if not self._backpressure:
+                    logging.warning(f"待处理队列已满 ({self._queue.maxsize})，暂停入队直到有空位。")
+                    self._backpressure = True
+                break
+            if self._backpressure:
+                logging.info("待处理队列已有空位，恢复入队。")
+                self._backpressure = False
+            logging.info(f"已加入处理队列: {os.path.basename(file_path)} (队列长度 {self._queue.qsize()})")
+
+        self._pending = current
+
+    @staticmethod
+    def _is_output_up_to_date(file_path: str, mtime: float) -> bool:
+        """输出文件存在且比输入文件新时，视为已处理（服务重启后避免重复处理）。"""
+        output_name = f"{os.path.splitext(os.path.basename(file_path))[0]}_with_images.xlsx"
+        output_path = os.path.join(OUTPUT_DIR, output_name)
+        try:
+            return os.path.getmtime(output_path) >= mtime
+        except OSError:
+            return False
+
+    def _worker_loop(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                file_path, signature = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            succeeded = False
+            try:
+                succeeded = self._process_file(file_path)
+            except Exception as e:
+                logging.error(f"处理文件 {file_path} 时发生意外错误: {e}", exc_info=True)
+            finally:
+                self._finish_file(file_path, signature, succeeded)
+                self._queue.task_done()
+
+    def _finish_file(self, file_path: str, signature: Tuple[float, int], succeeded: bool) -> None:
+        """记录处理结果：成功的文件不再处理，失败的文件按退避时间重新入队。"""
+        with self._seen_lock:
+            self._in_flight.discard(file_path)
+            if succeeded:
+                self._seen[file_path] = signature
+                self._failures.pop(file_path, None)
+                return
+            previous = self._failures.get(file_path)
+            attempts = previous[1] + 1 if previous and previous[0] == signature else 1
+            if attempts > WATCH_MAX_RETRIES:
+                logging.error(f"文件 {os.path.basename(file_path)} 已连续失败 {WATCH_MAX_RETRIES} 次，"
+                              f"文件修改后再重试。")
+                self._seen[file_path] = signature
+                self._failures.pop(file_path, None)
+                return
+            delay = WATCH_RETRY_DELAY * 2 ** (attempts - 1)
+            self._failures[file_path] = (signature, attempts, time.monotonic() + delay)
+        logging.warning(f"文件 {os.path.basename(file_path)} 处理失败，{delay:.0f} 秒后重试（第 {attempts} 次）。")
+
+    def _process_file(self, file_path: str) -> bool:
+        """
+        处理单个工作簿的全部 sheet
+        :return: 处理成功返回 True；无法读取（例如仍被 Excel 占用）或保存失败返回 False
+        """
+        file_basename = os.path.basename(file_path)
+        sheet_info = ExcelImageEmbedder.get_file_and_sheet_info([file_path]).get(file_basename, [])
+        if not sheet_info:
+            logging.warning(f"文件 {file_basename} 无法读取 sheet 信息，稍后重试。")
+            return False
+        sheet_indices = [sheet_index for sheet_index, _ in sheet_info]
+        failed_files = self._embedder.embed_images([file_path], {file_basename: sheet_indices}, enforce_limits=False)
+        return not failed_files